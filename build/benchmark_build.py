@@ -0,0 +1,282 @@
+"""Benchmark the build script on a synthetic corpus of notebooks.
+
+A temporary site is filled with generated `content/<post>/<post>.ipynb`
+notebooks containing markdown, PNG figures, pandas-style HTML tables and
+stream output, and `build_pages.py` is timed end to end over it in each of
+the requested modes. For example
+
+    python build/benchmark_build.py --posts 40 --png-kb 200 --html-rows 500
+
+compares a serial build, a parallel build and incremental rebuilds.
+
+Throughput is given over the posts each mode converts: the whole corpus for
+full builds and the no-op rebuild, which still checks every post, but only
+the edited post for `incremental-one`. Memory is the largest resident set of
+any one process of the build, so in parallel modes it is that of the biggest
+worker rather than the total of the pool.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+BUILD_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_SCRIPT = os.path.join(BUILD_DIR, 'build_pages.py')
+TEMPLATE_PATH = os.path.join(BUILD_DIR, 'markdown_with_captions.tpl')
+MODES = ('serial', 'parallel', 'incremental-noop', 'incremental-one', 'cli')
+
+
+def make_png(num_bytes, rng):
+    """Create a valid RGB PNG of random noise of roughly `num_bytes`."""
+    width = 256
+    height = max(1, num_bytes // (3 * width))
+    rows = b''.join(b'\x00' + rng.randbytes(3 * width) for _ in range(height))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(rows, 1)),
+        chunk(b'IEND', b''),
+    ])
+
+
+def make_html_table(num_rows, rng):
+    """Create the HTML that pandas renders for a dataframe in a notebook."""
+    rows = ''.join(
+        f'    <tr>\n      <th>{row}</th>\n'
+        + ''.join(f'      <td>{rng.random():.6f}</td>\n' for _ in range(4))
+        + '    </tr>\n'
+        for row in range(num_rows)
+    )
+    return (
+        '<div>\n<style scoped>\n    .dataframe tbody tr th:only-of-type {\n'
+        '        vertical-align: middle;\n    }\n</style>\n'
+        '<table border="1" class="dataframe">\n  <thead>\n'
+        '    <tr style="text-align: right;">\n      <th></th>\n'
+        + ''.join(f'      <th>col_{column}</th>\n' for column in range(4))
+        + '    </tr>\n  </thead>\n  <tbody>\n'
+        + rows
+        + '  </tbody>\n</table>\n</div>'
+    )
+
+
+def make_notebook(args, rng):
+    """Create a synthetic notebook as a JSON-serialisable dictionary."""
+    cells = []
+    for index in range(args.cells):
+        cells.append({
+            'cell_type': 'markdown',
+            'metadata': {},
+            'source': f'## Section {index}\n\n' + 'Lorem ipsum dolor. ' * 20,
+        })
+        outputs = [{
+            'name': 'stdout',
+            'output_type': 'stream',
+            'text': [f'line {line}\n' for line in range(args.stream_lines)],
+        }]
+        if args.png_kb:
+            png = make_png(args.png_kb * 1024, rng)
+            outputs.append({
+                'data': {
+                    'image/png': base64.b64encode(png).decode('ascii'),
+                    'text/plain': ['<Figure size 432x288 with 1 Axes>'],
+                },
+                'metadata': {'needs_background': 'light'},
+                'output_type': 'display_data',
+            })
+        if args.html_rows:
+            outputs.append({
+                'data': {
+                    'text/html': make_html_table(args.html_rows, rng),
+                    'text/plain': ['<dataframe>'],
+                },
+                'execution_count': index + 1,
+                'metadata': {},
+                'output_type': 'execute_result',
+            })
+        cells.append({
+            'cell_type': 'code',
+            'execution_count': index + 1,
+            'metadata': {},
+            'outputs': outputs,
+            'source': f'df_{index} = make_frame({index})\ndf_{index}',
+        })
+    return {
+        'cells': cells,
+        'metadata': {
+            'kernelspec': {'display_name': 'Python 3', 'language': 'python',
+                           'name': 'python3'},
+            'language_info': {'name': 'python'},
+        },
+        'nbformat': 4,
+        'nbformat_minor': 4,
+    }
+
+
+def write_notebook(site_dir, post, notebook):
+    post_dir = os.path.join(site_dir, 'content', post)
+    os.makedirs(post_dir, exist_ok=True)
+    with open(os.path.join(post_dir, f'{post}.ipynb'), 'w',
+              encoding='utf8') as file:
+        json.dump(notebook, file, indent=1)
+
+
+def content_bytes(path):
+    """Return the total size of the files under `path`."""
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def make_site(site_dir, args):
+    """Lay out a site with a generated corpus, returning its total size."""
+    rng = random.Random(args.seed)
+    os.makedirs(os.path.join(site_dir, 'build'))
+    os.makedirs(os.path.join(site_dir, 'source', '_posts'))
+    os.makedirs(os.path.join(site_dir, 'source', 'images'))
+    shutil.copy(TEMPLATE_PATH, os.path.join(site_dir, 'build'))
+    for index in range(args.posts):
+        write_notebook(site_dir, f'post-{index:03d}', make_notebook(args, rng))
+    return content_bytes(os.path.join(site_dir, 'content'))
+
+
+def run_build(site_dir, build_args):
+    """Run the build script in `site_dir`, returning its wall time and the
+    largest peak RSS of any one of its processes in bytes (`None` where this
+    cannot be measured)."""
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, BUILD_SCRIPT] + build_args, cwd=site_dir,
+            stdout=subprocess.DEVNULL, stderr=stderr)
+        rss = None
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # the maximum over the build and the workers it waited for, not
+            # their sum; reported in bytes on macOS but kilobytes elsewhere
+            rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        else:
+            process.wait()
+        seconds = time.perf_counter() - start
+
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(
+                f"build failed with arguments {build_args}:\n"
+                + stderr.read().decode('utf8', 'replace'))
+    return seconds, rss
+
+
+def benchmark_mode(mode, site_dir, args):
+    """Time a single build in the given mode, preparing the site first."""
+    if mode == 'serial':
+        return run_build(site_dir, ['--force', '--jobs', '1'])
+    if mode == 'parallel':
+        return run_build(site_dir, ['--force', '--jobs', str(args.jobs)])
+    if mode == 'cli':
+        return run_build(site_dir, ['--force', '--jobs', str(args.jobs),
+                                    '--use-cli'])
+
+    # incremental modes time a rebuild after an up-to-date build
+    run_build(site_dir, ['--jobs', str(args.jobs)])
+    if mode == 'incremental-one':
+        rng = random.Random(time.perf_counter_ns())
+        write_notebook(site_dir, 'post-000', make_notebook(args, rng))
+    return run_build(site_dir, ['--jobs', str(args.jobs)])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--posts', type=int, default=20,
+                        help="number of posts to generate (default: 20)")
+    parser.add_argument('--cells', type=int, default=10,
+                        help="code cells per notebook (default: 10)")
+    parser.add_argument('--png-kb', type=int, default=50,
+                        help="size of the PNG output of each code cell in kB, "
+                             "or 0 for none (default: 50)")
+    parser.add_argument('--html-rows', type=int, default=50,
+                        help="rows in the HTML table output of each code "
+                             "cell, or 0 for none (default: 50)")
+    parser.add_argument('--stream-lines', type=int, default=5,
+                        help="lines printed by each code cell (default: 5)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help="workers for the parallel modes "
+                             "(default: CPU count)")
+    parser.add_argument('--modes', nargs='+', choices=MODES,
+                        default=[mode for mode in MODES if mode != 'cli'],
+                        help="build modes to compare (default: all but cli)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs of each mode, keeping the fastest "
+                             "(default: 3)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed for the generated corpus (default: 0)")
+    parser.add_argument('--json', metavar='PATH',
+                        help="also save the results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='wdss-benchmark-') as site_dir:
+        corpus_bytes = make_site(site_dir, args)
+        print(f"generated {args.posts} posts ({corpus_bytes / 2**20:.1f} MB) "
+              f"in {site_dir}")
+
+        results = {}
+        for mode in args.modes:
+            runs = [benchmark_mode(mode, site_dir, args)
+                    for _ in range(args.repeat)]
+            seconds = min(run[0] for run in runs)
+            rss = [run[1] for run in runs if run[1] is not None]
+            # an incremental rebuild after an edit only converts that post
+            if mode == 'incremental-one':
+                posts = 1
+                built_bytes = content_bytes(
+                    os.path.join(site_dir, 'content', 'post-000'))
+            else:
+                posts, built_bytes = args.posts, corpus_bytes
+            results[mode] = {
+                'seconds': seconds,
+                'posts_built': posts,
+                'bytes_built': built_bytes,
+                'posts_per_second': posts / seconds,
+                'mb_per_second': built_bytes / 2**20 / seconds,
+                'max_process_rss': max(rss) if rss else None,
+            }
+
+    print(f"{'mode':<20}{'seconds':>10}{'posts':>7}{'posts/s':>10}"
+          f"{'MB/s':>10}{'max proc RSS MB':>17}")
+    for mode, result in results.items():
+        rss = result['max_process_rss']
+        print(f"{mode:<20}{result['seconds']:>10.3f}"
+              f"{result['posts_built']:>7}"
+              f"{result['posts_per_second']:>10.1f}"
+              f"{result['mb_per_second']:>10.1f}"
+              + (f'{rss / 2**20:>17.1f}' if rss is not None else f"{'-':>17}"))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as file:
+            json.dump({'parameters': vars(args), 'corpus_bytes': corpus_bytes,
+                       'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
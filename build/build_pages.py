@@ -1,82 +1,639 @@
 """Script to convert source notebooks to markdown and format correctly."""
 
+import argparse
+import contextlib
+import functools
+import hashlib
+import json
 import re
 import os
 import platform
-import shutil
 import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-if not os.path.exists('source/_posts'):
-    os.mkdir('source/_posts')
+from image_optimisation import can_optimise, optimise_images
+from notebook_execution import can_execute, execute_notebook
+from notebook_images import (
+    clean_image_store, placeholder_index, publish_images,
+    strip_notebook_images,
+)
+from output_budget import BUDGET_LIMITS, post_budget, prune_outputs
 
-for post in os.listdir('content'):
-    # check notebook exists
-    if post in ('.ipynb_checkpoints', '.DS_Store'):
-        continue
-    notebook_path = f"content/{post}/{post}.ipynb"
-    if not os.path.exists(notebook_path):
-        raise RuntimeError(f"could not find notebook for post {post}")
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+IGNORED_ENTRIES = ('.ipynb_checkpoints', '.DS_Store')
+TEMPLATE_PATH = 'build/markdown_with_captions.tpl'
+MANIFEST_PATH = 'build/.cache/manifest.json'
+PROFILE_PATH = 'build/.cache/profile.json'
+CLEAR_REFS_PATH = '/proc/self/clear_refs'
+STATUS_PATH = '/proc/self/status'
+PROFILE_STAGES = ('execute', 'convert', 'optimise', 'publish', 'postprocess', 'write')
+
+# cell tags used to hide parts of a notebook from the published post
+TAG_REMOVE_CONFIG = {
+    'remove_cell_tags': ['remove_cell'],
+    'remove_input_tags': ['remove_input'],
+    'remove_single_output_tags': ['remove_single_output'],
+    'remove_all_outputs_tags': ['remove_all_output'],
+}
+
+# substitutions applied to the converted markdown after the image paths have
+# been corrected, as (pattern, replacement, flags)
+MARKDOWN_SUBSTITUTIONS = (
+    # remove captions
+    # (r'!\[\w+\]', '![]', 0),
+
+    # remove additional table formatting
+    ('table border="1" class="dataframe"', 'table', 0),
+    ('tr style="text-align: right;"', 'tr', 0),
+    (r'</table>[\r\n]{1,2}</div>', '</table>', 0),
+    (r'<div>.*?</style>', '', re.DOTALL),
+)
+MARKDOWN_PATTERNS = tuple(
+    (re.compile(pattern, flags), replacement)
+    for pattern, replacement, flags in MARKDOWN_SUBSTITUTIONS
+)
+
+
+def find_posts():
+    """Return the names of all posts in `content`, in a stable order."""
+    return sorted(post for post in os.listdir('content')
+                  if post not in IGNORED_ENTRIES)
+
+
+def convert_notebook_cli(notebook_path):
+    """Convert a notebook to markdown using the nbconvert CLI.
 
-    # convert to markdown
+    Returns the markdown and a dictionary mapping the file name of each
+    extracted image to its contents.
+    """
     system = platform.system()
     if system == 'Windows':
         process = subprocess.Popen([
             'jupyter', 'nbconvert',
             notebook_path,
-            '--to', 'markdown', '--template=build/markdown_with_captions.tpl',
+            '--to', 'markdown', f'--template={TEMPLATE_PATH}',
             '--TagRemovePreprocessor.enabled=True',
-            "--TagRemovePreprocessor.remove_cell_tags=['remove_cell']",
-            "--TagRemovePreprocessor.remove_input_tags=['remove_input']",
-            "--TagRemovePreprocessor.remove_single_output_tags=['remove_single_output']",
-            "--TagRemovePreprocessor.remove_all_outputs_tags=['remove_all_output']",
+        ] + [
+            f"--TagRemovePreprocessor.{option}={tags}"
+            for option, tags in TAG_REMOVE_CONFIG.items()
         ], shell=True)
     elif system in ('Linux', 'Darwin'):
         process = subprocess.Popen(' '.join([
             'jupyter nbconvert',
             notebook_path,
             '--to markdown',
-            '--template=build/markdown_with_captions.tpl',
+            f'--template={TEMPLATE_PATH}',
             '--TagRemovePreprocessor.enabled=True',
-            "--TagRemovePreprocessor.remove_cell_tags=\"['remove_cell']\"",
-            "--TagRemovePreprocessor.remove_input_tags=\"['remove_input']\"",
-            "--TagRemovePreprocessor.remove_single_output_tags=\"['remove_single_output']\"",
-            "--TagRemovePreprocessor.remove_all_outputs_tags=\"['remove_all_output']\"",
+        ] + [
+            f"--TagRemovePreprocessor.{option}=\"{tags}\""
+            for option, tags in TAG_REMOVE_CONFIG.items()
         ]), shell=True)
     else:
         raise NotImplementedError("build does currently not support system")
-    process.wait()
-    
-    markdown_path = f'content/{post}/{post}.md'
-    image_dir_path = f'content/{post}/{post}_files/'
+    if process.wait() != 0:
+        raise RuntimeError(f"nbconvert failed to convert {notebook_path}")
+
+    notebook_name = os.path.splitext(notebook_path)[0]
+    with open(f'{notebook_name}.md', 'r', encoding='utf8', newline='') as file:
+        body = file.read()
+    os.remove(f'{notebook_name}.md')
+
+    images = {}
+    image_dir_path = f'{notebook_name}_files'
+    if os.path.exists(image_dir_path):
+        for image in os.listdir(image_dir_path):
+            with open(os.path.join(image_dir_path, image), 'rb') as file:
+                images[image] = file.read()
+            os.remove(os.path.join(image_dir_path, image))
+        os.rmdir(image_dir_path)
+    return body, images
+
+
+@functools.lru_cache(maxsize=None)
+def get_exporter():
+    """Create the markdown exporter, once per process.
+
+    This is configured to match the options passed by `convert_notebook_cli`.
+    """
+    from nbconvert import MarkdownExporter
+    from traitlets.config import Config
+
+    config = Config()
+    config.TagRemovePreprocessor.enabled = True
+    for option, tags in TAG_REMOVE_CONFIG.items():
+        config.TagRemovePreprocessor[option] = set(tags)
+    return MarkdownExporter(config=config, template_file=TEMPLATE_PATH)
+
+
+def apply_output_budget(notebook, notebook_name, budget):
+    """Cut down a notebook's outputs in place to fit `budget`, or the budget
+    set in its metadata, returning the attachments for any replaced."""
+    return prune_outputs(
+        notebook, notebook_name, post_budget(notebook, budget),
+        removed_cell_tags=(TAG_REMOVE_CONFIG['remove_cell_tags']
+                           + TAG_REMOVE_CONFIG['remove_all_outputs_tags']),
+        removed_output_tags=TAG_REMOVE_CONFIG['remove_single_output_tags'])
+
+
+def convert_notebook_api(notebook_path, scratch_dir, budget):
+    """Convert a notebook to markdown within this process.
 
-    with open(markdown_path, 'r', encoding='utf8') as file:
-        file_data = file.read()
+    PNG and JPEG outputs are decoded into `scratch_dir` while the notebook is
+    read, so nbconvert only ever sees small placeholders for them.
+
+    Returns the markdown and a dictionary mapping the file name of each
+    extracted image or attachment to its contents, or the path of a file in
+    `scratch_dir` holding them.
+    """
+    import nbformat
+
+    notebook_dir, notebook_file = os.path.split(notebook_path)
+    notebook_name = os.path.splitext(notebook_file)[0]
+    notebook_json, streamed_images = strip_notebook_images(
+        notebook_path, scratch_dir)
+    notebook = nbformat.reads(notebook_json, as_version=4)
+    del notebook_json
+    attachments = apply_output_budget(notebook, notebook_name, budget)
+
+    # name the outputs as `from_filename` and the nbconvert CLI would
+    resources = {
+        'metadata': {'name': notebook_name, 'path': notebook_dir},
+        'unique_key': notebook_name,
+        'output_files_dir': f'{notebook_name}_files',
+    }
+    body, resources = get_exporter().from_notebook_node(
+        notebook, resources=resources)
+
+    images = attachments
+    for filename, data in resources['outputs'].items():
+        index = placeholder_index(data)
+        images[os.path.basename(filename)] = (
+            data if index is None else streamed_images[index])
+    return body, images
+
+
+def convert_notebook(notebook_path, scratch_dir, budget, use_cli=False):
+    """Convert a notebook to markdown, returning it and its images.
+
+    `budget` limits the size of the notebook's outputs, as described in
+    `output_budget`. The conversion runs in-process unless `use_cli` is set
+    or nbconvert cannot be imported, in which case the nbconvert CLI is used
+    instead.
+    """
+    if not use_cli:
+        try:
+            get_exporter()
+        except ImportError:
+            use_cli = True
+    if not use_cli:
+        return convert_notebook_api(notebook_path, scratch_dir, budget)
+
+    # the CLI can only be given a file, so convert a pruned copy if needed
+    with open(notebook_path, 'r', encoding='utf8') as file:
+        notebook = json.load(file)
+    notebook_file = os.path.basename(notebook_path)
+    attachments = {}
+    if any(post_budget(notebook, budget).values()):
+        attachments = apply_output_budget(
+            notebook, os.path.splitext(notebook_file)[0], budget)
+        notebook_path = os.path.join(scratch_dir, notebook_file)
+        with open(notebook_path, 'w', encoding='utf8') as file:
+            json.dump(notebook, file)
+    del notebook
+    body, images = convert_notebook_cli(notebook_path)
+    return body, {**attachments, **images}
+
+
+def postprocess_markdown(post, markdown, image_urls=None):
+    """Fix image links and tidy up dataframe HTML in converted markdown.
+
+    Links to images named in `image_urls` are pointed at the given URLs and
+    any others at the post's image directory.
+
+    Each substitution is a separate pass with a precompiled pattern, as
+    these can skip straight to their literal prefix whereas a single
+    combined pattern has to be tried at every position in the text.
+    """
+    # normalise line endings, as reading the markdown in text mode used to
+    if '\r' in markdown:
+        markdown = markdown.replace('\r\n', '\n').replace('\r', '\n')
 
     # correct image paths
-    file_data = re.sub(f'{post}_files/', f'/images/{post}/', file_data)
+    for name, url in (image_urls or {}).items():
+        markdown = markdown.replace(f'{post}_files/{name}', url)
+    markdown = markdown.replace(f'{post}_files/', f'/images/{post}/')
 
-    # remove captions
-    # file_data = re.sub(r'!\[\w+\]', '![]', file_data)
+    for pattern, replacement in MARKDOWN_PATTERNS:
+        markdown = pattern.sub(replacement, markdown)
+    return markdown
 
-    # remove additional table formatting
-    file_data = re.sub('table border="1" class="dataframe"', 'table', file_data)
-    file_data = re.sub('tr style="text-align: right;"', 'tr', file_data)
-    file_data = re.sub(r'</table>[\r\n]{1,2}</div>', '</table>', file_data)
-    file_data = re.sub(r'<div>.*?</style>', '', file_data, flags=re.DOTALL)
 
-    with open(markdown_path, 'w', encoding='utf8') as file:
-        file.write(file_data)
+# the largest peak RSS of this process before it was last reset for a stage
+cleared_peak_rss = 0
 
-    # move files
-    shutil.move(markdown_path, f'source/_posts/{post}.md')
-    if os.path.exists(image_dir_path):
-        target_image_dir_path = f'source/images/{post}/'
-        if not os.path.exists(target_image_dir_path):
-            os.mkdir(target_image_dir_path)
+
+def peak_rss():
+    """Return the largest peak resident set size of this process and the
+    children it has waited for in bytes, if known."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(who).ru_maxrss
+               for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    # reported in bytes on macOS but kilobytes elsewhere
+    peak = peak if sys.platform == 'darwin' else peak * 1024
+    return max(peak, cleared_peak_rss)
+
+
+def status_peak_rss():
+    """Return the peak RSS of this process in bytes since it was last reset,
+    from `/proc/self/status`."""
+    with open(STATUS_PATH, encoding='ascii') as file:
+        for line in file:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"no VmHWM in {STATUS_PATH}")
+
+
+def start_stage_memory():
+    """Start measuring the peak memory of a stage on its own, returning how
+    it is measured.
+
+    The peak RSS never goes down, so on Linux it is reset through
+    `/proc/self/clear_refs` and read back as VmHWM. Elsewhere the peak of
+    the memory allocated by Python is traced instead.
+    """
+    global cleared_peak_rss
+    try:
+        peak = status_peak_rss()
+        with open(CLEAR_REFS_PATH, 'w', encoding='ascii') as file:
+            file.write('5')
+    except OSError:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return 'tracemalloc'
+    cleared_peak_rss = max(cleared_peak_rss, peak)
+    return 'rss'
+
+
+def stage_memory(method):
+    """Return the peak memory in bytes since `start_stage_memory`."""
+    if method == 'rss':
+        return status_peak_rss()
+    return tracemalloc.get_traced_memory()[1]
+
+
+@contextlib.contextmanager
+def profile_stage(stats, stage):
+    """Record the wall time and peak memory of a stage in `stats`.
+
+    Does nothing if `stats` is `None`, so profiling can be left switched off.
+    """
+    if stats is None:
+        yield
+        return
+    method = start_stage_memory()
+    start = time.perf_counter()
+    yield
+    stats['stages'][stage] = {
+        'seconds': time.perf_counter() - start,
+        'peak_memory': stage_memory(method),
+        'memory': method,
+    }
+
+
+def run_post_notebook(post, notebook_path, scratch_dir, timeout):
+    """Execute a post's notebook, or fill it in from the execution cache,
+    returning the path of the copy in `scratch_dir` holding the results."""
+    import nbformat
+
+    notebook = nbformat.read(notebook_path, as_version=4)
+    if execute_notebook(notebook, f'content/{post}', timeout):
+        print(f"executed {post}")
+    executed_path = os.path.join(scratch_dir, os.path.basename(notebook_path))
+    nbformat.write(notebook, executed_path)
+    return executed_path
+
+
+def build_post(post, options, use_cli=False, profile=False):
+    """Convert a single post, writing its markdown and images to `source`.
+
+    `options` is a dictionary of the settings that affect the output, as
+    described in `parse_args`. This is safe to run for several posts at once
+    as it only touches files belonging to the post, or shared files named
+    after their contents.
+
+    Returns the paths of the published images and, if `profile` is set, the
+    time taken by each stage and the size of the post's inputs and outputs.
+    """
+    # check notebook exists
+    notebook_path = f"content/{post}/{post}.ipynb"
+    if not os.path.exists(notebook_path):
+        raise RuntimeError(f"could not find notebook for post {post}")
+
+    stats = None
+    if profile:
+        stats = {
+            'stages': {},
+            'sizes': {'notebook': os.path.getsize(notebook_path)},
+        }
+
+    # images are decoded next to where they will end up, so they can be
+    # renamed into place rather than copied
+    os.makedirs('source/images', exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=f'.{post}-',
+                                     dir='source/images') as scratch_dir:
+        if options['execute']:
+            with profile_stage(stats, 'execute'):
+                notebook_path = run_post_notebook(
+                    post, notebook_path, scratch_dir,
+                    options['execute_timeout'])
+
+        # convert to markdown
+        with profile_stage(stats, 'convert'):
+            markdown, images = convert_notebook(
+                notebook_path, scratch_dir,
+                {limit: options[limit] for limit in BUDGET_LIMITS}, use_cli)
+        links = {}
+        if any(options[setting] for setting in
+               ('optimise_images', 'max_image_width', 'webp')):
+            with profile_stage(stats, 'optimise'):
+                images, links = optimise_images(images, options, scratch_dir)
+        with profile_stage(stats, 'publish'):
+            images, urls = publish_images(
+                post, images, options['image_store'])
+        image_urls = {name: urls[links.get(name, name)] for name in urls}
+        with profile_stage(stats, 'postprocess'):
+            markdown = postprocess_markdown(post, markdown, image_urls)
+        markdown_path = f'source/_posts/{post}.md'
+        with profile_stage(stats, 'write'):
+            with open(markdown_path, 'w', encoding='utf8') as file:
+                file.write(markdown)
+
+    if stats is not None:
+        stats['sizes']['markdown'] = os.path.getsize(markdown_path)
+        stats['sizes']['images'] = sum(
+            os.path.getsize(image) for image in images)
+    return images, stats
+
+
+def rules_digest(options):
+    """Hash everything other than the notebook that affects a post's output."""
+    digest = hashlib.sha256()
+    with open(TEMPLATE_PATH, 'rb') as file:
+        digest.update(file.read())
+    digest.update(repr(MARKDOWN_SUBSTITUTIONS).encode('utf8'))
+    digest.update(json.dumps(options, sort_keys=True).encode('utf8'))
+    return digest.hexdigest()
+
+
+def post_digest(post, rules):
+    """Hash a post's notebook together with the build rules.
+
+    Returns `None` if the post has no notebook, so it is always rebuilt (and
+    reported as a failure).
+    """
+    notebook_path = f"content/{post}/{post}.ipynb"
+    if not os.path.exists(notebook_path):
+        return None
+    digest = hashlib.sha256(rules.encode('utf8'))
+    with open(notebook_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest():
+    """Read the record of previously built posts, if there is one."""
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    temp_path = f'{MANIFEST_PATH}.tmp'
+    with open(temp_path, 'w', encoding='utf8') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(temp_path, MANIFEST_PATH)
+
+
+def is_up_to_date(post, digest, manifest):
+    """Check whether a post's published output was built from `digest`."""
+    entry = manifest.get(post)
+    if digest is None or entry is None or entry['hash'] != digest:
+        return False
+    return (os.path.exists(f'source/_posts/{post}.md')
+            and all(os.path.exists(image) for image in entry['images']))
+
+
+def build_posts(posts, jobs, options, use_cli=False, profile=False):
+    """Build each post, using a pool of `jobs` processes if more than one.
+
+    Returns a dictionary of what `build_post` returned for each successful
+    post and another mapping the name of each post that failed to the
+    exception it raised, so one broken notebook does not stop the others.
+    """
+    results = {}
+    failures = {}
+    if jobs == 1:
+        for post in posts:
+            try:
+                results[post] = build_post(post, options, use_cli, profile)
+            except Exception as error:
+                failures[post] = error
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(build_post, post, options, use_cli, profile): post
+            for post in posts
+        }
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:
+                failures[futures[future]] = error
+    return results, failures
+
+
+def write_profile(path, stats, jobs, seconds):
+    """Save the profile of a build as JSON.
+
+    Each stage has its own peak memory, while `peak_rss` is the largest
+    resident set of any process of the build.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # the workers' peaks are partly hidden from `peak_rss` by the resets
+    peaks = [stage['peak_memory'] for post in stats.values()
+             for stage in post['stages'].values() if stage['memory'] == 'rss']
+    peak = peak_rss()
+    report = {
+        'jobs': jobs,
+        'seconds': seconds,
+        'peak_rss': max(peaks + [peak]) if peak is not None else None,
+        'posts': stats,
+    }
+    with open(path, 'w', encoding='utf8') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+
+
+def print_profile(stats):
+    """Print a table of the profiled posts, slowest first."""
+    def total_seconds(post):
+        return sum(stage['seconds'] for stage in stats[post]['stages'].values())
+
+    header = (f"{'post':<30}{'total':>8}"
+              + ''.join(f'{stage:>12}' for stage in PROFILE_STAGES)
+              + f"{'peak MB':>9}{'nb kB':>9}{'md kB':>9}{'img kB':>9}")
+    print(header)
+    print('-' * len(header))
+    for post in sorted(stats, key=total_seconds, reverse=True):
+        stages = stats[post]['stages']
+        sizes = stats[post]['sizes']
+        memory = max((stage['peak_memory'] for stage in stages.values()),
+                     default=0)
+        print(f'{post:<30}{total_seconds(post):>8.2f}'
+              + ''.join(f"{stages[stage]['seconds']:>12.3f}"
+                        if stage in stages else f"{'':>12}"
+                        for stage in PROFILE_STAGES)
+              + f'{memory / 2**20:>9.1f}'
+              + ''.join(f'{sizes.get(size, 0) / 2**10:>9.1f}'
+                        for size in ('notebook', 'markdown', 'images')))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help="number of posts to convert in parallel (default: CPU count)")
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help="rebuild every post, even if it has not changed")
+    parser.add_argument(
+        '--use-cli', action='store_true',
+        help="convert with a `jupyter nbconvert` process per post instead "
+             "of in-process")
+    parser.add_argument(
+        '--profile', nargs='?', const=PROFILE_PATH, metavar='PATH',
+        help="time each stage of each post, printing a summary and saving "
+             f"the full report as JSON (default: {PROFILE_PATH})")
+    parser.add_argument(
+        '--image-store', action='store_true',
+        help="publish images to source/images/store named by the hash of "
+             "their contents, so identical images are only stored once")
+    parser.add_argument(
+        '--optimise-images', action='store_true',
+        help="losslessly recompress PNG figures (requires Pillow)")
+    parser.add_argument(
+        '--max-image-width', type=int, metavar='PIXELS',
+        help="scale down figures wider than this (requires Pillow)")
+    parser.add_argument(
+        '--webp', action='store_true',
+        help="also save figures as WebP and link to those from the posts "
+             "(requires Pillow)")
+    parser.add_argument(
+        '--max-output-bytes', type=int, metavar='BYTES',
+        help="replace text outputs larger than this with a link to the full "
+             "output")
+    parser.add_argument(
+        '--max-table-rows', type=int, metavar='ROWS',
+        help="truncate HTML tables to this many rows")
+    parser.add_argument(
+        '--max-stream-lines', type=int, metavar='LINES',
+        help="truncate printed output to this many lines")
+    parser.add_argument(
+        '--execute', action='store_true',
+        help="run each post's notebook before converting it, reusing the "
+             "outputs of cells that have not changed (requires nbclient)")
+    parser.add_argument(
+        '--execute-timeout', type=int, metavar='SECONDS',
+        help="fail a post whose notebook takes longer than this to run")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    for option in ('max_image_width', 'execute_timeout') + BUDGET_LIMITS:
+        value = getattr(args, option)
+        if value is not None and value < 1:
+            parser.error(f"--{option.replace('_', '-')} must be at least 1")
+    if ((args.optimise_images or args.max_image_width or args.webp)
+            and not can_optimise()):
+        parser.error("optimising images requires Pillow to be installed")
+    if args.execute and not can_execute():
+        parser.error("executing notebooks requires nbclient to be installed")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+
+    if not os.path.exists('source/_posts'):
+        os.mkdir('source/_posts')
+
+    # settings that change the output, so are part of each post's hash
+    options = {
+        'image_store': args.image_store,
+        'optimise_images': args.optimise_images,
+        'max_image_width': args.max_image_width,
+        'webp': args.webp,
+        'max_output_bytes': args.max_output_bytes,
+        'max_table_rows': args.max_table_rows,
+        'max_stream_lines': args.max_stream_lines,
+        'execute': args.execute,
+        'execute_timeout': args.execute_timeout,
+    }
+
+    posts = find_posts()
+    # the previous manifest is needed even when forcing a rebuild, to keep
+    # the images of posts that fail to build
+    manifest = load_manifest()
+    rules = rules_digest(options)
+    digests = {post: post_digest(post, rules) for post in posts}
+    stale_posts = [post for post in posts if args.force
+                   or not is_up_to_date(post, digests[post], manifest)]
+    print(f"building {len(stale_posts)} of {len(posts)} posts")
+    results, failures = {}, {}
+    if stale_posts:
+        results, failures = build_posts(
+            stale_posts, args.jobs, options, args.use_cli, bool(args.profile))
+
+    manifest = {post: entry for post, entry in manifest.items()
+                if post in posts}
+    stats = {}
+    for post in stale_posts:
+        if post in failures:
+            # keep the images in use by the previously published version
+            if post in manifest:
+                manifest[post]['hash'] = None
         else:
-            for image in os.listdir(target_image_dir_path):
-                if re.match(post, image):
-                    os.remove(f'{target_image_dir_path}{image}')
-        for image in os.listdir(image_dir_path):
-            shutil.move(f'{image_dir_path}{image}', f'{target_image_dir_path}')
-        os.rmdir(image_dir_path)
+            images, stats[post] = results[post]
+            manifest[post] = {'hash': digests[post], 'images': images}
+    save_manifest(manifest)
+    clean_image_store(
+        {image for entry in manifest.values() for image in entry['images']})
+
+    if args.profile:
+        write_profile(args.profile, stats, args.jobs,
+                      time.perf_counter() - start)
+        if stats:
+            print_profile(stats)
+
+    if failures:
+        for post in sorted(failures):
+            print(f"failed to build {post}: {failures[post]}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
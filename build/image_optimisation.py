@@ -0,0 +1,124 @@
+"""Optional optimisation of the figures extracted from notebooks.
+
+PNGs can be recompressed losslessly, images wider than a given width scaled
+down and WebP copies made for the markdown to link to instead. This needs
+Pillow, which is only imported once an image has to be optimised. The result
+for each image is cached by the hash of its contents and the settings used,
+so repeated builds only pay for images that have changed.
+"""
+
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+
+OPTIMISED_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+CACHE_PATH = 'build/.cache/images'
+
+
+def can_optimise():
+    """Check whether Pillow is installed, without importing it."""
+    return importlib.util.find_spec('PIL') is not None
+
+
+def optimise_image(data, extension, settings):
+    """Optimise the contents of a single PNG or JPEG image.
+
+    Returns the new contents and, if `settings['webp']` is set, those of a
+    WebP version (otherwise `None`).
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        resized = False
+        max_width = settings['max_image_width']
+        if max_width and image.width > max_width:
+            if image.mode in ('1', 'P'):
+                image = image.convert('RGBA')
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height), Image.LANCZOS)
+            resized = True
+
+        if extension == '.png' and (resized or settings['optimise_images']):
+            output = io.BytesIO()
+            image.save(output, 'PNG', optimize=True)
+            # recompressing can occasionally make a PNG larger
+            if resized or output.tell() < len(data):
+                data = output.getvalue()
+        elif resized:
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=90, optimize=True)
+            data = output.getvalue()
+
+        webp = None
+        if settings['webp']:
+            output = io.BytesIO()
+            image.save(output, 'WEBP', lossless=extension == '.png',
+                       quality=90, method=6)
+            webp = output.getvalue()
+    return data, webp
+
+
+def cached_optimise_image(data, extension, settings):
+    """Optimise an image as `optimise_image` does, reusing earlier results.
+
+    Returns the paths of the cached files holding the new contents and the
+    WebP version (or `None`).
+    """
+    key = hashlib.sha256(data)
+    key.update(json.dumps(settings, sort_keys=True).encode('utf8'))
+    key = key.hexdigest()
+    entry_path = os.path.join(CACHE_PATH, key[:2], key)
+    image_path = f'{entry_path}{extension}'
+    webp_path = f'{entry_path}.webp' if settings['webp'] else None
+
+    # the image itself is written last, so marks a complete entry
+    if not os.path.exists(image_path):
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        data, webp = optimise_image(data, extension, settings)
+        for path, contents in ((webp_path, webp), (image_path, data)):
+            if path is not None:
+                temp_path = f'{path}.{os.getpid()}.tmp'
+                with open(temp_path, 'wb') as file:
+                    file.write(contents)
+                os.replace(temp_path, path)
+    return image_path, webp_path
+
+
+def optimise_images(images, settings, scratch_dir):
+    """Optimise a post's extracted images.
+
+    `images` maps each image's file name to its contents or the path of a
+    file holding them; other than PNGs and JPEGs, these are passed through
+    untouched. Optimised images are copied into `scratch_dir`.
+
+    Returns the images in the same form, including any WebP versions, and a
+    dictionary mapping the names of images that have a WebP version to its
+    name, for the markdown to link to.
+    """
+    optimised = {}
+    links = {}
+    for name, image in images.items():
+        stem, extension = os.path.splitext(name)
+        extension = extension.lower()
+        if extension not in OPTIMISED_EXTENSIONS:
+            optimised[name] = image
+            continue
+
+        if not isinstance(image, bytes):
+            with open(image, 'rb') as file:
+                image = file.read()
+        image_path, webp_path = cached_optimise_image(
+            image, extension, settings)
+
+        # copy out of the cache, as publishing moves files into place
+        optimised[name] = shutil.copyfile(
+            image_path, os.path.join(scratch_dir, f'optimised-{name}'))
+        if webp_path is not None:
+            optimised[f'{stem}.webp'] = shutil.copyfile(
+                webp_path, os.path.join(scratch_dir, f'optimised-{stem}.webp'))
+            links[name] = f'{stem}.webp'
+    return optimised, links
@@ -0,0 +1,121 @@
+"""Optional execution of notebooks before they are converted.
+
+Each post's notebook is run in its own kernel, from the post's directory, so
+its outputs are fresh rather than whatever was last committed. This needs
+nbclient, which is only imported once a notebook has to be run.
+
+The outputs of each code cell are cached under a key that hashes its source
+together with the source of every code cell before it, so a key only changes
+when the cell or something that ran before it does. The post's directory is
+hashed first, as the same code can print different things for different
+posts, for example when it reads a file next to the notebook. A notebook whose cells
+are all cached is filled in without starting a kernel. Otherwise it is run
+from the top, as a kernel's state cannot be restored part way through: the
+cells before the first changed one are still executed to rebuild that state,
+but keep their cached outputs, so rerunning a post only changes the outputs
+of the cells from the edit onwards.
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import time
+
+CACHE_PATH = 'build/.cache/execution'
+
+
+def cell_keys(notebook, path):
+    """Return the cache key of each code cell of the notebook of the post in
+    `path`, in order."""
+    kernel = notebook['metadata'].get('kernelspec', {}).get('name', '')
+    digest = hashlib.sha256(path.encode('utf8'))
+    digest.update(hashlib.sha256(kernel.encode('utf8')).digest())
+    keys = []
+    for cell in notebook['cells']:
+        if cell['cell_type'] != 'code':
+            continue
+        source = cell['source']
+        if isinstance(source, list):
+            source = ''.join(source)
+        digest.update(hashlib.sha256(source.encode('utf8')).digest())
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+
+def can_execute():
+    """Check whether nbclient is installed, without importing it."""
+    return importlib.util.find_spec('nbclient') is not None
+
+
+def cache_entry_path(key):
+    return os.path.join(CACHE_PATH, key[:2], f'{key}.json')
+
+
+def load_cell(key):
+    """Return the cached outputs and execution count of a cell, or `None`."""
+    try:
+        with open(cache_entry_path(key), 'r', encoding='utf8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_cell(key, cell):
+    path = cache_entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf8') as file:
+        json.dump({'outputs': cell['outputs'],
+                   'execution_count': cell['execution_count']}, file)
+    os.replace(temp_path, path)
+
+
+def run_notebook(notebook, path, timeout):
+    """Execute a notebook in place in a new kernel started in `path`.
+
+    `timeout` is the number of seconds the whole notebook may take, or
+    `None` for no limit.
+    """
+    from nbclient import NotebookClient
+
+    client = NotebookClient(notebook, resources={'metadata': {'path': path}})
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with client.setup_kernel():
+        for index, cell in enumerate(notebook['cells']):
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"notebook took longer than {timeout} seconds")
+                client.timeout = max(1, int(remaining))
+            client.execute_cell(cell, index)
+
+
+def execute_notebook(notebook, path, timeout=None):
+    """Fill in the outputs of a notebook, executing it if any of its code
+    cells are not in the cache.
+
+    Returns whether the notebook was executed.
+    """
+    from nbformat import from_dict
+
+    cells = [cell for cell in notebook['cells'] if cell['cell_type'] == 'code']
+    keys = cell_keys(notebook, path)
+    cached = []
+    # keys are chained, so every cell after a miss is a miss too
+    for key in keys:
+        entry = load_cell(key)
+        if entry is None:
+            break
+        cached.append(entry)
+
+    executed = len(cached) < len(cells)
+    if executed:
+        run_notebook(notebook, path, timeout)
+    for cell, entry in zip(cells, cached):
+        cell['outputs'] = from_dict(entry['outputs'])
+        cell['execution_count'] = entry['execution_count']
+    for cell, key in zip(cells[len(cached):], keys[len(cached):]):
+        save_cell(key, cell)
+    return executed
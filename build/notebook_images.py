@@ -0,0 +1,299 @@
+"""Extraction and publishing of the images embedded in notebook outputs.
+
+Most of the bytes in a plot-heavy notebook are base64-encoded PNG and JPEG
+outputs. `strip_notebook_images` reads a notebook's JSON a chunk at a time,
+decoding these straight to files and copying everything else, so memory use
+does not grow with the size of the images.
+
+`publish_images` then puts the images either in a directory per post or in
+a store shared by all posts, named by the hash of their contents, so that
+identical figures are only kept once. Either way, files whose contents have
+not changed are left alone.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+
+STREAMED_MIME_TYPES = ('image/png', 'image/jpeg')
+CHUNK_SIZE = 1 << 16
+PLACEHOLDER_PREFIX = b'wdss-streamed-image:'
+IMAGE_STORE_PATH = 'source/images/store'
+IMAGE_STORE_URL = '/images/store'
+
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+STRING_RUN = re.compile(r'[^"\\]*')
+LITERAL_RUN = re.compile(r'[^\s,:\[\]{}"]*')
+
+
+def placeholder(index):
+    """Return the base64 payload standing in for the `index`th image."""
+    return base64.b64encode(PLACEHOLDER_PREFIX + str(index).encode('ascii'))
+
+
+def placeholder_index(data):
+    """Return the index of the image that decoded placeholder `data` stands
+    for, or `None` if it is not a placeholder."""
+    if isinstance(data, bytes) and data.startswith(PLACEHOLDER_PREFIX):
+        return int(data[len(PLACEHOLDER_PREFIX):])
+    return None
+
+
+class Base64Writer:
+    """Decode base64 text written in arbitrary pieces to a binary file."""
+
+    def __init__(self, file):
+        self.file = file
+        self.pending = ''
+
+    def write(self, text):
+        text = self.pending + text
+        cut = len(text) - len(text) % 4
+        self.file.write(binascii.a2b_base64(text[:cut]))
+        self.pending = text[cut:]
+
+    def close(self):
+        if self.pending:
+            self.file.write(binascii.a2b_base64(self.pending))
+            self.pending = ''
+
+
+class NotebookImageStripper:
+    """Copy notebook JSON from a file, decoding image outputs to files.
+
+    Only the data of `cells[*].outputs[*].data[<mime type>]` is streamed, for
+    the mime types in `STREAMED_MIME_TYPES`; images elsewhere, such as in
+    markdown cell attachments, are copied like any other value.
+    """
+
+    def __init__(self, file, image_dir):
+        self.file = file
+        self.image_dir = image_dir
+        self.buffer = ''
+        self.position = 0
+        self.pieces = []
+        self.images = []
+        # one [bracket, current key, expecting key] entry per open container
+        self.stack = []
+
+    def _peek(self):
+        if self.position == len(self.buffer):
+            self.buffer = self.file.read(CHUNK_SIZE)
+            self.position = 0
+        return self.buffer[self.position:self.position + 1]
+
+    def _next(self):
+        char = self._peek()
+        self.position += len(char)
+        return char
+
+    def _take_run(self, pattern):
+        """Consume the characters matched by `pattern`, across chunks."""
+        parts = []
+        while self._peek():
+            match = pattern.match(self.buffer, self.position)
+            parts.append(match.group())
+            self.position = match.end()
+            if self.position < len(self.buffer):
+                break
+        return ''.join(parts)
+
+    def _raw_string(self):
+        """Consume the rest of a string, returning it as it appears in JSON."""
+        parts = ['"']
+        while True:
+            parts.append(self._take_run(STRING_RUN))
+            char = self._next()
+            if char == '"':
+                parts.append(char)
+                return ''.join(parts)
+            if not char:
+                raise ValueError("notebook ends within a string")
+            parts.append(char + self._next())
+
+    def _decode_string(self, writer):
+        """Consume the rest of a base64 string, passing it to `writer`."""
+        while True:
+            writer.write(self._take_run(STRING_RUN))
+            char = self._next()
+            if char == '"':
+                return
+            if not char:
+                raise ValueError("notebook ends within a string")
+            escape = self._next()
+            if escape == '/':
+                writer.write('/')
+            elif escape not in 'nrt':
+                raise ValueError(f"unexpected escape \\{escape} in image data")
+
+    def _stream_image(self, opening):
+        """Decode an image value, a string or list of strings, to a file and
+        return the JSON for its placeholder."""
+        index = len(self.images)
+        image_path = os.path.join(self.image_dir, str(index))
+        with open(image_path, 'wb') as file:
+            writer = Base64Writer(file)
+            if opening == '"':
+                self._decode_string(writer)
+            else:
+                while True:
+                    self._take_run(WHITESPACE)
+                    char = self._next()
+                    if char == ']':
+                        break
+                    if char == '"':
+                        self._decode_string(writer)
+                    elif char != ',':
+                        raise ValueError("image data must be made of strings")
+            writer.close()
+        self.images.append(image_path)
+        return f'"{placeholder(index).decode("ascii")}"'
+
+    def _at_image(self):
+        """Check whether the value about to be read is a streamed image."""
+        stack = self.stack
+        return (len(stack) == 6
+                and stack[0][1] == 'cells'
+                and stack[2][1] == 'outputs'
+                and stack[4][1] == 'data'
+                and stack[5][1] in STREAMED_MIME_TYPES)
+
+    def strip(self):
+        """Copy the whole notebook, returning the JSON with its images
+        replaced by placeholders."""
+        while True:
+            self.pieces.append(self._take_run(WHITESPACE))
+            char = self._next()
+            if not char:
+                return ''.join(self.pieces)
+            frame = self.stack[-1] if self.stack else None
+            in_key = frame is not None and frame[0] == '{' and frame[2]
+            at_value = frame is not None and frame[0] == '{' and not frame[2]
+
+            if char in '"[' and at_value and self._at_image():
+                self.pieces.append(self._stream_image(char))
+            elif char in '{[':
+                self.stack.append([char, None, True])
+                self.pieces.append(char)
+            elif char in '}]':
+                self.stack.pop()
+                self.pieces.append(char)
+            elif char == '"':
+                raw = self._raw_string()
+                if in_key:
+                    frame[1] = json.loads(raw)
+                self.pieces.append(raw)
+            elif char in ':,':
+                if frame is not None and frame[0] == '{':
+                    frame[2] = char == ','
+                self.pieces.append(char)
+            else:
+                self.pieces.append(char + self._take_run(LITERAL_RUN))
+
+
+def strip_notebook_images(notebook_path, image_dir):
+    """Read a notebook, decoding its PNG and JPEG outputs into `image_dir`.
+
+    Returns the notebook's JSON with the `n`th image replaced by
+    `placeholder(n)`, and a list of the paths the images were written to.
+    """
+    with open(notebook_path, 'r', encoding='utf8', newline='') as file:
+        stripper = NotebookImageStripper(file, image_dir)
+        notebook_json = stripper.strip()
+    return notebook_json, stripper.images
+
+
+def image_digest(image):
+    """Hash an image, given as its contents or the path of a file."""
+    if isinstance(image, bytes):
+        return hashlib.sha256(image).hexdigest()
+    digest = hashlib.sha256()
+    with open(image, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def put_image(image, target_path, digest=None):
+    """Write an image, given as its contents or the path of a file to move,
+    to `target_path`.
+
+    If the target already holds the same contents it is left untouched, so
+    its modification time is kept. When `digest` is given the target is
+    assumed to be named after it, and so only needs to exist.
+    """
+    if os.path.exists(target_path):
+        if digest is not None:
+            unchanged = True
+        else:
+            size = (len(image) if isinstance(image, bytes)
+                    else os.path.getsize(image))
+            unchanged = (os.path.getsize(target_path) == size
+                         and image_digest(target_path) == image_digest(image))
+        if unchanged:
+            if not isinstance(image, bytes):
+                os.remove(image)
+            return
+
+    if isinstance(image, bytes):
+        # write alongside and rename so other workers never see part of it
+        temp_path = f'{target_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(image)
+        image = temp_path
+    os.replace(image, target_path)
+
+
+def publish_images(post, images, store=False):
+    """Put a post's extracted images into `source/images`.
+
+    `images` maps each image's file name to its contents or the path of a
+    file to move into place. These go in `source/images/<post>`, unless
+    `store` is set, in which case they go in the shared image store.
+    Images left over from previous builds of the post are removed from its
+    directory.
+
+    Returns the paths of the published images and a dictionary mapping
+    their names to their URLs.
+    """
+    post_image_dir_path = f'source/images/{post}/'
+    paths = []
+    urls = {}
+    if images:
+        os.makedirs(IMAGE_STORE_PATH if store else post_image_dir_path,
+                    exist_ok=True)
+    for name, image in sorted(images.items()):
+        if store:
+            digest = image_digest(image)
+            stored_name = f'{digest[:32]}{os.path.splitext(name)[1]}'
+            path = f'{IMAGE_STORE_PATH}/{stored_name}'
+            put_image(image, path, digest)
+            urls[name] = f'{IMAGE_STORE_URL}/{stored_name}'
+        else:
+            path = f'{post_image_dir_path}{name}'
+            put_image(image, path)
+            urls[name] = f'/images/{post}/{name}'
+        paths.append(path)
+
+    # leave directories alone if nothing was extracted, as they may only
+    # hold images added by hand
+    if images and os.path.exists(post_image_dir_path):
+        for image in os.listdir(post_image_dir_path):
+            if re.match(post, image) and (store or image not in images):
+                os.remove(f'{post_image_dir_path}{image}')
+    return paths, urls
+
+
+def clean_image_store(referenced):
+    """Remove images from the store that are not in `referenced`."""
+    if not os.path.exists(IMAGE_STORE_PATH):
+        return
+    for name in os.listdir(IMAGE_STORE_PATH):
+        path = f'{IMAGE_STORE_PATH}/{name}'
+        if path not in referenced:
+            os.remove(path)
+    if not os.listdir(IMAGE_STORE_PATH):
+        os.rmdir(IMAGE_STORE_PATH)
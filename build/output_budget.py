@@ -0,0 +1,172 @@
+"""Limits on how much of each notebook output is inlined into a post.
+
+A budget has three limits, any of which may be `None` to switch it off:
+
+- `max_table_rows`: rows kept in the body of each HTML table
+- `max_stream_lines`: lines kept of each stream (printed) output
+- `max_output_bytes`: size of any one text output, after the limits above;
+  larger outputs are saved as an attachment and replaced by a link to it
+
+The build's defaults can be overridden for a single post in its notebook's
+metadata, for example
+
+    "metadata": {"wdss": {"output_budget": {"max_table_rows": 100}}}
+"""
+
+import re
+import sys
+
+BUDGET_LIMITS = ('max_output_bytes', 'max_table_rows', 'max_stream_lines')
+METADATA_KEY = 'wdss'
+ATTACHMENT_EXTENSIONS = {
+    'text/html': '.html',
+    'text/markdown': '.md',
+    'text/latex': '.tex',
+    'text/plain': '.txt',
+}
+
+TABLE_BODY = re.compile(r'(<tbody>)(.*?)(</tbody>)', re.DOTALL)
+TABLE_ROW = re.compile(r'[ \t]*<tr[\s>].*?</tr>\n?', re.DOTALL)
+TABLE_CELL = re.compile(r'<t[dh][\s>]')
+
+
+def post_budget(notebook, defaults):
+    """Combine the build's budget with any set in the notebook's metadata."""
+    budget = {limit: defaults.get(limit) for limit in BUDGET_LIMITS}
+    overrides = notebook['metadata'].get(METADATA_KEY, {}).get(
+        'output_budget', {})
+    for limit, value in overrides.items():
+        if limit not in BUDGET_LIMITS:
+            raise ValueError(f"unknown output budget limit {limit!r}")
+        if value is not None and (not isinstance(value, int) or value < 1):
+            raise ValueError(f"output budget {limit} must be a positive "
+                             "integer or null")
+        budget[limit] = value
+    return budget
+
+
+def warn(message):
+    print(f"warning: {message}", file=sys.stderr)
+
+
+def join_text(text):
+    """Return notebook text, which may be split into a list of lines."""
+    return ''.join(text) if isinstance(text, list) else text
+
+
+def truncate_lines(text, max_lines):
+    """Keep the first `max_lines` lines of `text`.
+
+    Returns the new text and the number of lines removed.
+    """
+    lines = text.splitlines(keepends=True)
+    hidden = len(lines) - max_lines
+    if hidden <= 0:
+        return text, 0
+    kept = ''.join(lines[:max_lines])
+    if not kept.endswith('\n'):
+        kept += '\n'
+    return f'{kept}... ({hidden} more lines not shown)\n', hidden
+
+
+def truncate_table_rows(html, max_rows):
+    """Keep the first `max_rows` rows of the body of each table in `html`.
+
+    Hidden rows are replaced by a single row saying how many there were.
+    Returns the new HTML and the number of rows removed.
+    """
+    hidden_total = 0
+
+    def truncate_body(match):
+        nonlocal hidden_total
+        rows = TABLE_ROW.findall(match.group(2))
+        hidden = len(rows) - max_rows
+        if hidden <= 0:
+            return match.group()
+        hidden_total += hidden
+        columns = len(TABLE_CELL.findall(rows[0]))
+        note = (f'    <tr>\n      <td colspan="{columns}">'
+                f'... {hidden} more rows not shown</td>\n    </tr>\n')
+        return (match.group(1) + '\n' + ''.join(rows[:max_rows]) + note
+                + '  ' + match.group(3))
+
+    html = TABLE_BODY.sub(truncate_body, html)
+    return html, hidden_total
+
+
+def output_text(output):
+    """Return the text types of an output as a dictionary of strings."""
+    if output['output_type'] == 'stream':
+        return {'text/plain': join_text(output['text'])}
+    return {mime_type: join_text(data)
+            for mime_type, data in output.get('data', {}).items()
+            if mime_type in ATTACHMENT_EXTENSIONS}
+
+
+def attachment_output(output, text, post, name):
+    """Create an output linking to an attachment in place of `output`."""
+    node = type(output)
+    size = len(text.encode('utf8'))
+    link = (f'*This output is too large to show here ({size / 2**10:.0f} kB),'
+            f' [view it in full]({post}_files/{name}).*')
+    return node(output_type='display_data', metadata=node(),
+                data=node({'text/markdown': link}))
+
+
+def prune_outputs(notebook, post, budget, removed_cell_tags=(),
+                  removed_output_tags=()):
+    """Apply an output budget to a notebook in place, warning about each
+    output that is cut down or replaced.
+
+    Outputs that will be removed anyway, because their cell has one of
+    `removed_cell_tags` or they have one of `removed_output_tags`, are left
+    alone. Returns a dictionary mapping the file name of each attachment to
+    its contents.
+    """
+    attachments = {}
+    if not any(budget.values()):
+        return attachments
+
+    for cell_index, cell in enumerate(notebook['cells']):
+        tags = set(cell['metadata'].get('tags', ()))
+        if cell['cell_type'] != 'code' or tags & set(removed_cell_tags):
+            continue
+        label = f"{post}: cell {cell_index}"
+        if cell.get('execution_count') is not None:
+            label += f" (In [{cell['execution_count']}])"
+
+        for output_index, output in enumerate(cell['outputs']):
+            if (set(output.get('metadata', {}).get('tags', ()))
+                    & set(removed_output_tags)):
+                continue
+            original = output_text(output)
+
+            if output['output_type'] == 'stream' and budget['max_stream_lines']:
+                text, hidden = truncate_lines(
+                    original['text/plain'], budget['max_stream_lines'])
+                if hidden:
+                    output['text'] = text
+                    warn(f"{label}: hid {hidden} lines of stream output")
+            if 'text/html' in original and budget['max_table_rows']:
+                html, hidden = truncate_table_rows(
+                    original['text/html'], budget['max_table_rows'])
+                if hidden:
+                    output['data']['text/html'] = html
+                    warn(f"{label}: hid {hidden} rows of an HTML table")
+
+            if not budget['max_output_bytes']:
+                continue
+            size = max((len(text.encode('utf8'))
+                        for text in output_text(output).values()), default=0)
+            if size > budget['max_output_bytes']:
+                # attach the untruncated output, in its largest form
+                mime_type = max(original, key=lambda mime_type: len(
+                    original[mime_type]))
+                name = (f'{post}_output_{cell_index}_{output_index}'
+                        f'{ATTACHMENT_EXTENSIONS[mime_type]}')
+                attachments[name] = original[mime_type].encode('utf8')
+                cell['outputs'][output_index] = attachment_output(
+                    output, original[mime_type], post, name)
+                warn(f"{label}: replaced a {size / 2**10:.0f} kB output with "
+                     f"a link to {name}")
+    return attachments
@@ -0,0 +1,282 @@
+"""Benchmark the DLM functions in `custompack.py` on synthetic series.
+
+A panel of random-walk sales series, with optional exogenous series, is
+generated for each series length and AR order asked for. `bayesian_update`,
+`past_vector` and `phi_modification` are timed per call at the matching
+state size, and `filter_arma`, `filter_arma_fast` and `filter_arma_batch`
+end to end over the panel, each also run once under `tracemalloc` to record
+the memory it allocates. For example
+
+    python benchmark_custompack.py --length 500 1000 --ar-terms 0 10 50
+
+The predictions of the faster filters are checked against `filter_arma`, and
+those of `filter_arma` can be saved with `--save-reference` and checked with
+`--reference` after a change, to catch a refactor that changes results.
+`--profile` saves `cProfile` statistics for `filter_arma`, which can be
+viewed as a flame graph with tools such as snakeviz.
+"""
+
+import argparse
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# 'custompack' builds empty series as default arguments, which pandas warns
+# about when it is imported
+warnings.simplefilter('ignore', FutureWarning)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import custompack  # noqa: E402
+
+FUNCTIONS = ('bayesian_update', 'past_vector', 'phi_modification',
+             'filter_arma', 'filter_arma_fast', 'filter_arma_batch')
+PREDICTED_STEPS = 16
+
+
+def make_panel(args, length, rng):
+    """Create `args.series` positive, integer sales-like series of `length`,
+    with `args.exog` exogenous series of noise for each."""
+    steps = rng.normal(size=(args.series, length))
+    panel = np.abs(np.cumsum(steps, axis=1) * 5 + 50).round()
+    exog = [rng.normal(size=(args.series, length)) for _ in range(args.exog)]
+    return panel, exog
+
+
+def hyperparameters(panel):
+    """Return a local level prior for each series of `panel`."""
+    return (panel[:, :1], np.array([[0.5]]), np.array([[1.]]),
+            np.array([[0.9]]))
+
+
+def filter_kwargs(args, ar_terms, exog, index):
+    """Return the keyword arguments shared by the single series filters."""
+    kwargs = {'int_ar_terms': ar_terms, 'int_series_cut': PREDICTED_STEPS,
+              'int_series_pred': PREDICTED_STEPS, 'float_delta': args.delta}
+    for name, series in zip(('series_y', 'series_z'), exog):
+        kwargs[name] = pd.Series(series[index])
+    return kwargs
+
+
+def run_filter(name, args, panel, exog, ar_terms):
+    """Run one of the filters over the whole panel, returning the
+    predictions as a (series, time) array."""
+    tuple_hyperpar = hyperparameters(panel)
+    if name == 'filter_arma_batch':
+        return custompack.filter_arma_batch(
+            panel, tuple_hyperpar, np.array([1.]),
+            matrix_y=exog[0] if exog else None,
+            matrix_z=exog[1] if len(exog) > 1 else None,
+            float_delta=args.delta, int_ar_terms=ar_terms,
+            int_series_cut=PREDICTED_STEPS, int_series_pred=PREDICTED_STEPS)
+
+    function = getattr(custompack, name)
+    return np.array([
+        function(pd.Series(panel[index]),
+                 (tuple_hyperpar[0][index],) + tuple_hyperpar[1:],
+                 np.array([1.]), **filter_kwargs(args, ar_terms, exog, index))
+        for index in range(len(panel))
+    ], dtype=float)
+
+
+def unit_calls(name, panel, exog, ar_terms):
+    """Return a function making one call of `name` for each time step of
+    the first series, and the number of calls it makes."""
+    series = pd.Series(panel[0])
+    length = len(series)
+    if name == 'past_vector':
+        def calls():
+            for t in range(length):
+                custompack.past_vector(series, ar_terms, t)
+        return calls, length
+
+    if name == 'phi_modification':
+        matrix_lags = custompack.lag_matrix(series, ar_terms)
+        vector_phi = np.array([1.])
+
+        def calls():
+            for t in range(length):
+                custompack.phi_modification(series, ar_terms, t, vector_phi,
+                                            matrix_lags=matrix_lags)
+        return calls, length
+
+    # the state size of the model 'filter_arma' fits to these series
+    tuple_hyperpar = (panel[0, :1],) + hyperparameters(panel)[1:]
+    for _ in range(1 + len(exog)):
+        tuple_hyperpar = custompack.arma_hyperpar_ext(ar_terms, tuple_hyperpar)
+    vector_m, matrix_b, matrix_f, matrix_sigma = tuple_hyperpar
+    vector_phi = np.ones(len(vector_m)) / len(vector_m)
+
+    def calls():
+        float_s, int_n = 0, 0
+        for t in range(length):
+            _, _, int_n, float_s = custompack.bayesian_update(
+                series[t], vector_m, matrix_b, vector_phi, matrix_f,
+                matrix_sigma, float_s_t_minus=float_s, int_n_t_minus=int_n)
+    return calls, length
+
+
+def measure(function, repeat):
+    """Time `function`, keeping the fastest of `repeat` runs, then run it
+    once more under `tracemalloc`.
+
+    Returns the seconds taken, the peak memory allocated while it ran and
+    the memory still allocated once it returned, in bytes, and its result.
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = min(seconds, time.perf_counter() - start)
+        del result
+
+    tracemalloc.start()
+    try:
+        result = function()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak, retained, result
+
+
+def compare(predictions, reference):
+    """Return the number of predictions differing from `reference`, all of
+    them if their shapes do not match."""
+    if predictions.shape != reference.shape:
+        return max(predictions.size, reference.size)
+    return int(np.sum(predictions != reference))
+
+
+def profile_filter(args, panel, exog, ar_terms, path):
+    """Save `cProfile` statistics for `filter_arma` over the panel to
+    `path`, printing the most expensive calls."""
+    profiler = cProfile.Profile()
+    profiler.runcall(run_filter, 'filter_arma', args, panel, exog, ar_terms)
+    profiler.dump_stats(path)
+    print(f"saved profile of filter_arma to {path}")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--length', type=int, nargs='+', default=[500],
+                        help="lengths of the generated series (default: 500)")
+    parser.add_argument('--ar-terms', type=int, nargs='+', default=[0, 10],
+                        help="autoregressive orders to fit (default: 0 10)")
+    parser.add_argument('--series', type=int, default=8,
+                        help="number of series in the panel (default: 8)")
+    parser.add_argument('--exog', type=int, choices=(0, 1, 2), default=0,
+                        help="exogenous series per series, passed as "
+                             "series_y and series_z (default: 0)")
+    parser.add_argument('--delta', type=float, default=0.98,
+                        help="discount factor of the DLM (default: 0.98)")
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS,
+                        default=list(FUNCTIONS),
+                        help="functions to benchmark (default: all)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs of each function, keeping the fastest "
+                             "(default: 3)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed for the generated series (default: 0)")
+    parser.add_argument('--save-reference', metavar='PATH',
+                        help="save the predictions of filter_arma to an .npz "
+                             "file")
+    parser.add_argument('--reference', metavar='PATH',
+                        help="check the predictions of filter_arma against "
+                             "ones saved with --save-reference")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="save cProfile statistics of filter_arma, for "
+                             "the first length and AR order, to PATH")
+    parser.add_argument('--json', metavar='PATH',
+                        help="also save the results as JSON")
+    args = parser.parse_args(argv)
+    if min(args.length) <= 2 * PREDICTED_STEPS:
+        parser.error(f"--length must be more than {2 * PREDICTED_STEPS}")
+    if args.reference and 'filter_arma' not in args.functions:
+        parser.error("--reference needs filter_arma to be benchmarked")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    reference = dict(np.load(args.reference)) if args.reference else {}
+    saved = {}
+    results = []
+    mismatched = False
+    for length, ar_terms in itertools.product(args.length, args.ar_terms):
+        rng = np.random.default_rng(args.seed)
+        panel, exog = make_panel(args, length, rng)
+        key = f'length_{length}_ar_{ar_terms}_exog_{args.exog}'
+        if args.profile and not results:
+            profile_filter(args, panel, exog, ar_terms, args.profile)
+
+        predictions = {}
+        for name in args.functions:
+            if name.startswith('filter_arma'):
+                calls = len(panel)
+                seconds, peak, retained, result = measure(
+                    lambda: run_filter(name, args, panel, exog, ar_terms),
+                    args.repeat)
+                predictions[name] = np.asarray(result, dtype=float)
+            else:
+                function, calls = unit_calls(name, panel, exog, ar_terms)
+                seconds, peak, retained, _ = measure(function, args.repeat)
+            results.append({
+                'function': name, 'length': length, 'ar_terms': ar_terms,
+                'seconds': seconds, 'calls': calls,
+                'us_per_call': seconds / calls * 1e6,
+                'peak_bytes': peak, 'retained_bytes': retained,
+                'mismatches': None,
+            })
+
+        # check the faster filters against 'filter_arma', and it against
+        # any saved reference
+        if 'filter_arma' in predictions:
+            expected = predictions['filter_arma']
+            saved[key] = expected
+            checks = {name: compare(value, expected)
+                      for name, value in predictions.items()
+                      if name != 'filter_arma'}
+            if args.reference:
+                if key in reference:
+                    checks['filter_arma'] = compare(expected, reference[key])
+                else:
+                    print(f"warning: {args.reference} has no predictions "
+                          f"for {key}", file=sys.stderr)
+            for result in results[-len(args.functions):]:
+                if result['function'] in checks:
+                    mismatches = checks[result['function']]
+                    result['mismatches'] = mismatches
+                    mismatched |= mismatches != 0
+
+    print(f"{'function':<20}{'length':>8}{'ar':>5}{'seconds':>10}"
+          f"{'us/call':>12}{'peak MB':>10}{'kept MB':>10}{'diff':>6}")
+    for result in results:
+        mismatches = result['mismatches']
+        print(f"{result['function']:<20}{result['length']:>8}"
+              f"{result['ar_terms']:>5}{result['seconds']:>10.3f}"
+              f"{result['us_per_call']:>12.1f}"
+              f"{result['peak_bytes'] / 2**20:>10.2f}"
+              f"{result['retained_bytes'] / 2**20:>10.2f}"
+              + (f"{'-':>6}" if mismatches is None else f'{mismatches:>6}'))
+
+    if args.save_reference:
+        np.savez(args.save_reference, **saved)
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as file:
+            json.dump({'parameters': vars(args), 'results': results}, file,
+                      indent=2)
+    if mismatched:
+        sys.exit("predictions differ from the reference")
+
+
+if __name__ == '__main__':
+    main()
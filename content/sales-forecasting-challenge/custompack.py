@@ -22,6 +22,51 @@ import datetime
 
 import sklearn.preprocessing
 
+# 'itertools' for building hyperparameter grids
+import itertools
+
+# 'concurrent.futures' and 'multiprocessing.shared_memory'
+# for spreading work over processes that share the
+# same series
+import concurrent.futures
+import multiprocessing.shared_memory
+
+# 'os', 'json' and 'hashlib' for keeping typed
+# copies of the data sets on disk
+import os
+import json
+import hashlib
+
+
+
+
+# Create 'dict_shared_series', where each worker
+# process of 'grid_search_arma' keeps the series
+# it reads from shared memory
+dict_shared_series = dict()
+
+# Create 'dict_column_dtypes', the types the
+# columns of the competition data sets are stored
+# as by 'read_csv_cached'
+dict_column_dtypes = {
+    'id': 'int32',
+    'date': 'datetime64[ns]',
+    'store_nbr': 'int16',
+    'family': 'category',
+    'sales': 'float32',
+    'onpromotion': 'int16',
+    'dcoilwtico': 'float32',
+    'transactions': 'int32',
+    'city': 'category',
+    'state': 'category',
+    'type': 'category',
+    'cluster': 'int8',
+    'locale': 'category',
+    'locale_name': 'category',
+    'description': 'category',
+    'transferred': 'bool',
+}
+
 
 
 
@@ -369,6 +414,50 @@ def past_vector(
 
 
 
+# Define the 'lag_matrix' function
+
+# Prerequisites:
+# - None
+
+def lag_matrix(
+    series_main,
+    int_length,
+):
+
+    '''
+    The 'lag_matrix' function returns a matrix
+    whose row 't' is the output of 'past_vector'
+    for the same series, length and time index 't',
+    for every 't' from 0 to the length of
+    'series_main'.
+
+    The series is copied once with 'int_length'
+    zeros in front, and the rows are read-only
+    sliding windows over that copy, so the whole
+    matrix takes no more memory than the series.
+    '''
+
+    # Create 'vector_padded', the series with
+    # 'int_length' zeros in front
+    vector_padded = np.zeros(
+        shape = int_length + len(series_main),
+        dtype = np.result_type(np.asarray(series_main).dtype, float),
+    )
+    vector_padded[int_length:] = series_main
+
+    # Create 'matrix_lags', the windows of length
+    # 'int_length' over 'vector_padded'
+    matrix_lags = np.lib.stride_tricks.sliding_window_view(
+        x = vector_padded,
+        window_shape = int_length,
+    )
+
+    # Return the lag matrix
+    return matrix_lags
+
+
+
+
 # Define the 'hyperpar_series_update' function
 
 # Prerequisites:
@@ -441,6 +530,7 @@ def phi_modification(
     int_length,
     int_t,
     vector_phi,
+    matrix_lags = None,
 ):
 
     '''
@@ -449,6 +539,11 @@ def phi_modification(
     observations to allow for the DLM to learn
     the autoregressive parameters.
 
+    If 'matrix_lags', the output of 'lag_matrix'
+    for 'series_main' and 'int_length', is given,
+    the past observations are read from it instead
+    of from 'series_main'.
+
     Returns the original transition vector if
     the given series has no data.
     '''
@@ -466,11 +561,14 @@ def phi_modification(
         # of observations to be appended to
         # 'vector_phi' so autoregressive model is
         # initiated
-        vector_observations = past_vector(
-            series_main = series_main,
-            int_length = int_length,
-            int_t = int_t
-        )
+        if matrix_lags is not None and 0 <= int_t < len(matrix_lags):
+            vector_observations = matrix_lags[int_t]
+        else:
+            vector_observations = past_vector(
+                series_main = series_main,
+                int_length = int_length,
+                int_t = int_t
+            )
 
         # Create 'vector_phi_mod', the expanded
         # version of the transition vector
@@ -524,7 +622,7 @@ def discreter(
 # Define the 'filter_arma' function
 
 # Prerequisites:
-# - None
+# - 'lag_matrix' // function
 
 def filter_arma(
     series_x,
@@ -536,6 +634,7 @@ def filter_arma(
     int_ar_terms = 0,
     int_series_cut = 0,
     int_series_pred = 0,
+    bool_variance = False,
 ):
 
     '''
@@ -544,6 +643,11 @@ def filter_arma(
 
     It is possible to use two more series to aid
     with predictions for the main series.
+
+    If 'bool_variance' is True, the predictive
+    variances of the last 'int_series_pred'
+    predictions are returned as a second series,
+    with the same index as those predictions.
     '''
 
     # Create 'int_x_length', the length of the main
@@ -583,9 +687,33 @@ def filter_arma(
         tuple_hyperpar = tuple_hyperpar,
     )
 
-    # Create 'list_predictions', the list on which all
-    # model predictions are appended to
-    list_predictions = list()
+    # Create the lag matrices of the three series,
+    # so the past observations for each time step
+    # do not have to be sliced from them
+    matrix_x_lags = lag_matrix(
+        series_main = series_x_f,
+        int_length = int_ar_terms,
+    )
+    matrix_y_lags = lag_matrix(
+        series_main = series_y_f,
+        int_length = int_ar_terms,
+    )
+    matrix_z_lags = lag_matrix(
+        series_main = series_z_f,
+        int_length = int_ar_terms,
+    )
+
+    # Create 'vector_predictions', the array on which
+    # all model predictions are stored
+    vector_predictions = np.zeros(
+        shape = int_x_pred_length,
+        dtype = int,
+    )
+
+    # Create 'int_n' and 'float_s', the sample size
+    # and sample variance of the residuals
+    int_n = 0
+    float_s = 0
 
     # For 'int_t', loop from 0 to 'int_x_cut_length' - 1
     for int_t in range(0, int_x_cut_length):
@@ -600,6 +728,7 @@ def filter_arma(
             int_length = int_ar_terms,
             int_t = int_t,
             vector_phi = vector_phi,
+            matrix_lags = matrix_x_lags,
         )
 
         # Create new 'vector_phi' to include
@@ -609,6 +738,7 @@ def filter_arma(
             int_length = int_ar_terms,
             int_t = int_t,
             vector_phi = vector_phi_mod,
+            matrix_lags = matrix_y_lags,
         )
 
         # Create new 'vector_phi' to include
@@ -618,6 +748,7 @@ def filter_arma(
             int_length = int_ar_terms,
             int_t = int_t,
             vector_phi = vector_phi_mod,
+            matrix_lags = matrix_z_lags,
         )
 
         # Create prediction 'float_prediction'
@@ -629,11 +760,8 @@ def filter_arma(
             float_num = float_prediction
         )
 
-        # Append 'float_prediction_discrete' to prediction 
-        # list
-        list_predictions.append(
-            float_prediction_discrete
-        )
+        # Store 'float_prediction_discrete'
+        vector_predictions[int_t] = float_prediction_discrete
 
         # Update the model hyperparameters by first
         # storing the data from 'bayesian_update'
@@ -646,6 +774,8 @@ def filter_arma(
             matrix_f = tuple_hyperpar[2],
             matrix_sigma = tuple_hyperpar[3],
             float_delta = float_delta,
+            float_s_t_minus = float_s,
+            int_n_t_minus = int_n,
         )
 
         # Then redefine 'tuple_hyperpar' with the
@@ -656,20 +786,42 @@ def filter_arma(
             tuple_hyperpar[2],
             tuple_hyperpar[3],
         )
-
-    # Create a version of the main series that will
-    # store the predictions necessary for modifying
-    # the transition vectore in future iterations
-    series_x_cut = series_extender(
-        series_main = series_x,
-        int_extension = -int_series_cut,
+        int_n = tuple_p[2]
+        float_s = tuple_p[3]
+
+    # Create 'vector_x_cut', a version of the main
+    # series that will store the predictions necessary
+    # for modifying the transition vector in future
+    # iterations
+    vector_x_cut = np.zeros(
+        shape = int_x_pred_length,
+    )
+    vector_x_cut[: int_x_cut_length] = series_x[: int_x_cut_length]
+
+    # Create 'vector_f_m', the prior mean carried
+    # forward to each horizon one multiplication by
+    # the transition matrix at a time, rather than
+    # with a fresh power of the transition matrix
+    vector_f_m = tuple_hyperpar[0]
+
+    # Create 'matrix_r', the weight matrix carried
+    # forward in the same way, if it is needed for
+    # the predictive variances
+    matrix_r = tuple_hyperpar[1]
+
+    # Create 'vector_variances', the array on which
+    # the predictive variances are stored
+    vector_variances = np.zeros(
+        shape = int_series_pred,
     )
 
     # The loop for generating the model predictions
     for int_t in range(int_x_cut_length, int_x_pred_length):
 
+        # Create new 'vector_phi' from the main series
+        # up to 'int_t', including earlier predictions
         vector_phi_mod = phi_modification(
-            series_main = series_x_cut,
+            series_main = vector_x_cut[: int_t],
             int_length = int_ar_terms,
             int_t = int_t,
             vector_phi = vector_phi,
@@ -680,6 +832,7 @@ def filter_arma(
             int_length = int_ar_terms,
             int_t = int_t,
             vector_phi = vector_phi_mod,
+            matrix_lags = matrix_y_lags,
         )
 
         vector_phi_mod = phi_modification(
@@ -687,36 +840,266 @@ def filter_arma(
             int_length = int_ar_terms,
             int_t = int_t,
             vector_phi = vector_phi_mod,
+            matrix_lags = matrix_z_lags,
         )
 
-        int_power = int_t - int_x_cut_length + 1
+        vector_f_m = tuple_hyperpar[2] @ vector_f_m
 
-        matrix_mod_f = np.linalg.matrix_power(
-            a = tuple_hyperpar[2],
-            n = int_power
-        )
+        float_prediction = vector_phi_mod @ vector_f_m
 
-        float_prediction = vector_phi_mod @ matrix_mod_f @ tuple_hyperpar[0]
-        
         float_prediction_discrete = discreter(
             float_num = float_prediction
         )
 
-        list_predictions.append(
-            float_prediction_discrete
+        vector_predictions[int_t] = float_prediction_discrete
+        vector_x_cut[int_t] = float_prediction_discrete
+
+        # Create the predictive variance, the sample
+        # variance scaled by the variance multiplier
+        # at this horizon
+        if bool_variance:
+            matrix_r = (
+                tuple_hyperpar[2] @ matrix_r @ tuple_hyperpar[2].T
+                + tuple_hyperpar[3]
+            )
+            vector_variances[int_t - int_x_cut_length] = float_s * (
+                float_delta + vector_phi_mod @ matrix_r @ vector_phi_mod
+            )
+
+    series_predictions = pd.Series(
+        data = vector_predictions
+    )
+
+    # Return the predictive variances as well
+    # if they were asked for
+    if bool_variance:
+        series_variances = pd.Series(
+            data = vector_variances,
+            index = range(int_x_cut_length, int_x_pred_length),
+        )
+        return (
+            series_predictions,
+            series_variances
+        )
+
+    return series_predictions
+
+
+
+
+# Define the 'filter_arma_fast' function
+
+# Prerequisites:
+# - 'hyperpar_series_update' // function
+
+def filter_arma_fast(
+    series_x,
+    tuple_hyperpar,
+    vector_phi,
+    series_y = pd.Series([]),
+    series_z = pd.Series([]),
+    float_delta = 1,
+    int_ar_terms = 0,
+    int_series_cut = 0,
+    int_series_pred = 0,
+    dtype_float = np.float64,
+    bool_compact = False,
+):
+
+    '''
+    The 'filter_arma_fast' function fits the same
+    DLM as 'filter_arma' and gives the same
+    predictions, but without creating new arrays at
+    each time step.
+
+    All state and work arrays are allocated once.
+    Each series used for autoregression is copied
+    once into an array with 'int_ar_terms' zeros in
+    front, so the window of past observations for
+    any time step is a slice of it, and the mean
+    vector and weight matrix are updated in place.
+
+    'dtype_float' sets the precision of the state
+    and predictions. If 'bool_compact' is True, the
+    predictions are returned as the array they were
+    stored in, rather than as a series of integers.
+    '''
+
+    # Create 'int_x_length', the length of the main
+    # series to be analysed
+    int_x_length = len(series_x)
+
+    # Create 'int_x_cut_length', the length of
+    # 'series_x' to actually be analysed
+    int_x_cut_length = int_x_length - int_series_cut
+
+    # Create 'int_x_pred_length', the length of the
+    # series once the predictions are added
+    int_x_pred_length = int_x_cut_length + int_series_pred
+
+    # Create 'int_terms', the number of terms in
+    # the DLM before any autoregression terms
+    int_terms = len(vector_phi)
+
+    # Create 'list_padded', the list of series used
+    # for autoregression with their leading zeros
+    list_padded = list()
+
+    # Loop over the three series, extending the
+    # hyperparameters for those that have data as
+    # 'filter_arma' does
+    for series_main in (series_x, series_y, series_z):
+
+        tuple_hyperpar, series_main_f = hyperpar_series_update(
+            int_ar_terms = int_ar_terms,
+            int_length = int_x_pred_length,
+            series_main = series_main,
+            tuple_hyperpar = tuple_hyperpar,
+        )
+
+        # Skip series without any data
+        if len(series_main_f) == 0:
+            continue
+
+        # Create 'vector_padded', the series with
+        # 'int_ar_terms' zeros in front
+        vector_padded = np.zeros(
+            shape = int_ar_terms + int_x_pred_length,
+            dtype = dtype_float,
+        )
+        vector_padded[int_ar_terms:] = series_main_f
+
+        list_padded.append(
+            vector_padded
         )
 
-        series_prediction_discrete = pd.Series(
-            data = float_prediction_discrete
+    # Create the state arrays, copied so the
+    # hyperparameters passed in are left untouched
+    vector_m = np.array(tuple_hyperpar[0], dtype = dtype_float)
+    matrix_b = np.array(tuple_hyperpar[1], dtype = dtype_float)
+    matrix_f = np.array(tuple_hyperpar[2], dtype = dtype_float)
+    matrix_sigma = np.array(tuple_hyperpar[3], dtype = dtype_float)
+
+    # Create 'int_state', the size of the state
+    int_state = len(vector_m)
+
+    # Create the work arrays for the update
+    matrix_fb = np.empty(shape = (int_state, int_state), dtype = dtype_float)
+    matrix_p = np.empty(shape = (int_state, int_state), dtype = dtype_float)
+    vector_f_m = np.empty(shape = int_state, dtype = dtype_float)
+    vector_g = np.empty(shape = int_state, dtype = dtype_float)
+
+    # Create 'vector_phi_mod', the transition vector
+    # that is filled in with past observations
+    vector_phi_mod = np.zeros(
+        shape = int_state,
+        dtype = dtype_float,
+    )
+    vector_phi_mod[: int_terms] = vector_phi
+
+    # Create 'vector_predictions', the array on which
+    # all model predictions are stored
+    vector_predictions = np.zeros(
+        shape = int_x_pred_length,
+        dtype = dtype_float,
+    )
+
+    # Create 'vector_x', the observations of the
+    # main series
+    vector_x = list_padded[0][int_ar_terms:]
+
+    # For 'int_t', loop from 0 to 'int_x_cut_length' - 1
+    for int_t in range(0, int_x_cut_length):
+
+        # Fill in the past observations of every
+        # series used for autoregression
+        for int_i, vector_padded in enumerate(list_padded):
+            int_start = int_terms + int_i * int_ar_terms
+            vector_phi_mod[int_start: int_start + int_ar_terms] = (
+                vector_padded[int_t: int_t + int_ar_terms]
+            )
+
+        # Create 'vector_f_m', the prior mean
+        # multiplied by the transition matrix
+        np.dot(matrix_f, vector_m, out = vector_f_m)
+
+        # Create the prediction, which the residual
+        # estimate is also based on
+        float_prediction = vector_phi_mod @ vector_f_m
+        vector_predictions[int_t] = float_prediction
+
+        # Create 'matrix_p', the pre-posterior
+        # weight matrix
+        np.dot(matrix_f, matrix_b, out = matrix_fb)
+        np.dot(matrix_fb, matrix_f.T, out = matrix_p)
+        matrix_p += matrix_sigma
+
+        # Create 'vector_g', the gain vector, after
+        # the variance multiplier 'float_q'
+        np.dot(matrix_p, vector_phi_mod, out = vector_g)
+        float_q = float_delta + vector_phi_mod @ vector_g
+        vector_g /= float_q
+
+        # Update 'vector_m' to the posterior mean
+        # vector using the residual estimate
+        np.multiply(
+            vector_g,
+            vector_x[int_t] - float_prediction,
+            out = vector_m,
         )
+        vector_m += vector_f_m
+
+        # Update 'matrix_b' to the posterior weight
+        # matrix with a symmetric rank one update,
+        # using 'matrix_fb' as scratch space
+        np.multiply(matrix_p, 1 / float_delta, out = matrix_b)
+        np.multiply.outer(vector_g, vector_g, out = matrix_fb)
+        matrix_fb *= float_q
+        matrix_b -= matrix_fb
+
+    # Make the one-step predictions discrete
+    # and non negative
+    vector_predictions = np.maximum(
+        np.round(vector_predictions),
+        0
+    )
 
-        series_x_cut = series_x_cut.append(
-            series_prediction_discrete,
-            ignore_index = True
+    # Replace the main series after the cut with
+    # the predictions, so these are used for
+    # autoregression in future iterations
+    list_padded[0][int_ar_terms + int_x_cut_length:] = 0
+
+    # The loop for generating the model predictions,
+    # carrying the mean forward one multiplication by
+    # the transition matrix at a time
+    for int_t in range(int_x_cut_length, int_x_pred_length):
+
+        for int_i, vector_padded in enumerate(list_padded):
+            int_start = int_terms + int_i * int_ar_terms
+            vector_phi_mod[int_start: int_start + int_ar_terms] = (
+                vector_padded[int_t: int_t + int_ar_terms]
+            )
+
+        np.dot(matrix_f, vector_m, out = vector_f_m)
+        vector_m[:] = vector_f_m
+
+        float_prediction_discrete = max(
+            round(vector_phi_mod @ vector_m),
+            0
         )
 
+        vector_predictions[int_t] = float_prediction_discrete
+        list_padded[0][int_ar_terms + int_t] = float_prediction_discrete
+
+    # Return the predictions array itself if
+    # compact output was asked for
+    if bool_compact:
+        return vector_predictions
+
+    # Return the predictions as a series of
+    # integers, as 'filter_arma' does
     series_predictions = pd.Series(
-        data = list_predictions
+        data = vector_predictions.astype(int),
     )
 
     return series_predictions
@@ -724,33 +1107,2271 @@ def filter_arma(
 
 
 
-def zero_one_scaler(
-    series_main
+# Define the 'matrix_extender' function
+
+# Prerequisites:
+# - None
+
+def matrix_extender(
+    matrix_main,
+    int_extension = 0,
 ):
 
-    minmaxscaler_scale = sklearn.preprocessing.MinMaxScaler(
-    feature_range = (0, 1)
+    '''
+    The 'matrix_extender' function is the batched
+    version of 'series_extender', where each row of
+    'matrix_main' is a separate series. It works the
+    same way on arrays with more axes, such as a
+    panel from 'panel_array', with each series along
+    the last axis.
+
+    All series are extended by the amount given if
+    'int_extension' is positive, repeating their last
+    entry, and shortened if 'int_extension' is
+    negative.
+    '''
+
+    # Check if 'int_extension' is zero
+    if int_extension == 0:
+
+        # Return the input matrix unchanged
+        return matrix_main
+
+    # Check if 'int_extension' is less than zero
+    elif int_extension < 0:
+
+        # Return the input matrix with the last
+        # -'int_extension' entries of each series
+        # cut off
+        return matrix_main[..., : matrix_main.shape[-1] + int_extension]
+
+    # Create 'matrix_repeat', the last entry of each
+    # series repeated 'int_extension' times
+    matrix_repeat = np.repeat(
+        a = matrix_main[..., -1:],
+        repeats = int_extension,
+        axis = -1,
     )
 
-    matrix_main = series_main.values.reshape(-1,1)
+    # Return 'matrix_main' with 'matrix_repeat'
+    # added on to the end of each series
+    return np.concatenate(
+        [
+            matrix_main,
+            matrix_repeat
+        ],
+        axis = -1,
+    )
 
-    matrix_scaled_main = minmaxscaler_scale.fit_transform(
-    X = matrix_main
+
+
+
+# Define the 'arma_hyperpar_ext_batch' function
+
+# Prerequisites:
+# - None
+
+def arma_hyperpar_ext_batch(
+    int_ar_terms,
+    tuple_hyperpar,
+):
+
+    '''
+    The 'arma_hyperpar_ext_batch' function is the
+    batched version of 'arma_hyperpar_ext'.
+
+    The prior mean and weight matrix in
+    'tuple_hyperpar' have one row and one matrix per
+    series respectively, while the transition matrix
+    and weight offset matrix are shared by all series.
+    '''
+
+    # Create 'int_terms', the number of terms
+    # in the DLM before the extension
+    int_terms = tuple_hyperpar[0].shape[1]
+
+    # Create the updated prior mean matrix, with
+    # zeros appended to every row
+    matrix_m_f = np.pad(
+        array = tuple_hyperpar[0],
+        pad_width = ((0, 0), (0, int_ar_terms)),
     )
 
-    series_scaled_main = pd.Series(
-        data = matrix_scaled_main.reshape(-1)
+    # Create the updated prior weight matrices,
+    # with zeros around the original blocks
+    tensor_b_f = np.pad(
+        array = tuple_hyperpar[1],
+        pad_width = ((0, 0), (0, int_ar_terms), (0, int_ar_terms)),
     )
-    
+
+    # Create 'vector_ar_index', the indices of
+    # the new autoregression terms
+    vector_ar_index = np.arange(
+        int_terms,
+        int_terms + int_ar_terms,
+    )
+
+    # Set the diagonal of the new blocks to 0.5,
+    # as 'arma_hyperpar_ext' does
+    tensor_b_f[:, vector_ar_index, vector_ar_index] = 0.5
+
+    # Create the updated transition matrix
+    matrix_f_f = scipy.linalg.block_diag(
+        tuple_hyperpar[2],
+        np.eye(
+            N = int_ar_terms,
+        ),
+    )
+
+    # Create the updated weight offset matrix
+    matrix_sigma_f = scipy.linalg.block_diag(
+        tuple_hyperpar[3],
+        np.zeros(
+            shape = (
+                int_ar_terms,
+                int_ar_terms
+            ),
+        ),
+    )
+
+    # Return the modified hyperparameters
     return (
-        series_scaled_main,
-        minmaxscaler_scale
+        matrix_m_f,
+        tensor_b_f,
+        matrix_f_f,
+        matrix_sigma_f
     )
 
-def null_detection(
-    dataframe
+
+
+
+# Define the 'bayesian_update_batch' function
+
+# Prerequisites:
+# - None
+
+def bayesian_update_batch(
+    vector_x_t,
+    matrix_m_t_minus,
+    tensor_b_t_minus,
+    matrix_phi,
+    matrix_f,
+    matrix_sigma,
+    float_delta = 1,
+    matrix_f_m = None,
+    vector_s_t_minus = None,
+    vector_n_t_minus = None,
 ):
 
-    bool_output = dataframe.isnull().any().any()
+    '''
+    The 'bayesian_update_batch' function carries out
+    the same update as 'bayesian_update' for many
+    series at once.
+
+    Row i of 'matrix_m_t_minus' and 'matrix_phi', and
+    matrix i of 'tensor_b_t_minus', belong to the
+    series whose new observation is 'vector_x_t[i]'.
+    'matrix_f' and 'matrix_sigma' are shared by all
+    series.
+
+    'matrix_f_m' may be given if the prior means
+    multiplied by 'matrix_f' have already been
+    calculated.
+
+    Only the posterior means and weight matrices are
+    returned, as 'filter_arma' does not use the others,
+    unless the prior sample variances and sizes
+    'vector_s_t_minus' and 'vector_n_t_minus' are
+    given, in which case their posteriors are also
+    returned as 'bayesian_update' does.
+    '''
 
-    return bool_output
+    # Create 'matrix_f_m', the prior means
+    # multiplied by the transition matrix
+    if matrix_f_m is None:
+        matrix_f_m = matrix_m_t_minus @ matrix_f.T
+
+    # Create 'tensor_p', the pre-posterior weight
+    # matrices of every series
+    tensor_p = matrix_f @ tensor_b_t_minus @ matrix_f.T + matrix_sigma
+
+    # Create 'matrix_p_phi', each pre-posterior
+    # weight matrix multiplied by its transition
+    # vector
+    matrix_p_phi = np.einsum(
+        'nij,nj->ni',
+        tensor_p,
+        matrix_phi,
+    )
+
+    # Create 'vector_q', the variance multipliers
+    vector_q = float_delta + np.einsum(
+        'ni,ni->n',
+        matrix_phi,
+        matrix_p_phi,
+    )
+
+    # Create 'matrix_g', the gain vectors
+    matrix_g = matrix_p_phi / vector_q[:, None]
+
+    # Create 'vector_e', the residual estimates
+    vector_e = vector_x_t - np.einsum(
+        'ni,ni->n',
+        matrix_phi,
+        matrix_f_m,
+    )
+
+    # Create 'matrix_m_t', the posterior mean vectors
+    matrix_m_t = matrix_f_m + matrix_g * vector_e[:, None]
+
+    # Create 'tensor_b_t', the posterior weight matrices
+    tensor_b_t = tensor_p / float_delta - (
+        matrix_g[:, :, None] * matrix_g[:, None, :] * vector_q[:, None, None]
+    )
+
+    # Return the posterior means and weight matrices
+    # alone if the sample variances are not needed
+    if vector_s_t_minus is None:
+        return (
+            matrix_m_t,
+            tensor_b_t
+        )
+
+    # Create 'vector_n_t', the posterior sample sizes
+    vector_n_t = vector_n_t_minus + 1
+
+    # Create 'vector_s_t', the posterior sample
+    # variances
+    vector_s_t = (float_delta / vector_n_t) * (
+        vector_n_t_minus * vector_s_t_minus + (vector_e ** 2) / vector_q
+    )
+    vector_s_t = vector_s_t.astype(vector_s_t_minus.dtype, copy = False)
+
+    # Return all posterior data
+    return (
+        matrix_m_t,
+        tensor_b_t,
+        vector_n_t,
+        vector_s_t
+    )
+
+
+
+
+# Define the 'cholesky_rank_one_update' function
+
+# Prerequisites:
+# - None
+
+def cholesky_rank_one_update(
+    tensor_r,
+    matrix_x,
+    float_sign = 1,
+):
+
+    '''
+    The 'cholesky_rank_one_update' function updates
+    upper triangular factors in place, so that for
+    each series the new factor R satisfies
+    R.T @ R = R_old.T @ R_old + 'float_sign' * x x.T,
+    where x is the series' row of 'matrix_x'.
+
+    'float_sign' is 1 for an update or -1 for a
+    downdate, which must leave the product positive
+    definite. 'matrix_x' is overwritten.
+    '''
+
+    # Create 'int_size', the size of the factors
+    int_size = tensor_r.shape[1]
+
+    # Eliminate the vectors one entry at a time
+    for int_k in range(int_size):
+
+        # Create 'vector_r_kk' and 'vector_x_k', the
+        # current diagonal entries and vector entries
+        vector_r_kk = tensor_r[:, int_k, int_k]
+        vector_x_k = matrix_x[:, int_k]
+
+        # Create the new diagonal entries and the
+        # rotation that produces them
+        vector_r = np.sqrt(vector_r_kk ** 2 + float_sign * vector_x_k ** 2)
+        vector_c = (vector_r / vector_r_kk)[:, None]
+        vector_s = (vector_x_k / vector_r_kk)[:, None]
+        tensor_r[:, int_k, int_k] = vector_r
+
+        # Apply the rotation to the rest of the row
+        # of the factors and of the vectors
+        tensor_r[:, int_k, int_k + 1:] += float_sign * vector_s * matrix_x[:, int_k + 1:]
+        tensor_r[:, int_k, int_k + 1:] /= vector_c
+        matrix_x[:, int_k + 1:] *= vector_c
+        matrix_x[:, int_k + 1:] -= vector_s * tensor_r[:, int_k, int_k + 1:]
+
+
+
+
+# Define the 'covariance_root_rows' function
+
+# Prerequisites:
+# - None
+
+def covariance_root_rows(
+    matrix_sigma,
+):
+
+    '''
+    The 'covariance_root_rows' function returns a
+    matrix with as few rows as possible whose rows x
+    satisfy sum(x x.T) = 'matrix_sigma', for adding a
+    positive semi-definite weight offset matrix to
+    factors with 'cholesky_rank_one_update'.
+
+    The weight offset matrices built by
+    'arma_hyperpar_ext' are zero outside the original
+    block, so this usually has very few rows.
+    '''
+
+    # Create the eigendecomposition of 'matrix_sigma'
+    vector_w, matrix_v = np.linalg.eigh(
+        a = matrix_sigma,
+    )
+
+    # Keep the eigenvectors with positive
+    # eigenvalues, scaled by their square roots
+    bool_positive = vector_w > np.finfo(float).eps * max(np.abs(vector_w).max(), 1)
+    return (matrix_v[:, bool_positive] * np.sqrt(vector_w[bool_positive])).T
+
+
+
+
+# Define the 'bayesian_update_cholesky' function
+
+# Prerequisites:
+# - 'cholesky_rank_one_update' // function
+
+def bayesian_update_cholesky(
+    vector_x_t,
+    matrix_m_t_minus,
+    tensor_r_t_minus,
+    matrix_phi,
+    matrix_f,
+    matrix_sigma_rows,
+    float_delta = 1,
+    matrix_f_m = None,
+):
+
+    '''
+    The 'bayesian_update_cholesky' function carries
+    out the same update as 'bayesian_update_batch',
+    but with each weight matrix B held as an upper
+    triangular factor R with B = R.T @ R, so the
+    weight matrices stay symmetric and positive
+    definite however long the series.
+
+    'matrix_sigma_rows' is the weight offset matrix
+    as returned by 'covariance_root_rows'.
+
+    Only the rows of 'matrix_f' that differ from the
+    identity matrix are multiplied out, so the
+    transition matrices built by 'arma_hyperpar_ext'
+    cost little more than the original block, and no
+    dense weight matrix is ever formed.
+
+    Returns the posterior means and factors.
+    '''
+
+    # Create 'int_state', the size of the state
+    int_state = matrix_f.shape[0]
+
+    # Create 'matrix_f_m', the prior means
+    # multiplied by the transition matrix
+    if matrix_f_m is None:
+        matrix_f_m = matrix_m_t_minus @ matrix_f.T
+
+    # Create 'tensor_r_p', the factors of the
+    # pre-posterior weight matrices without the
+    # weight offset, R F.T, which only differs
+    # from R in the columns for the rows of
+    # 'matrix_f' that are not the identity
+    tensor_r_p = tensor_r_t_minus.copy()
+    vector_rows = np.flatnonzero(
+        (matrix_f != np.eye(int_state)).any(axis = 1)
+    )
+    if len(vector_rows) > 0:
+        tensor_r_p[:, :, vector_rows] = tensor_r_t_minus @ matrix_f[vector_rows].T
+
+        # Make the factors triangular again if
+        # 'matrix_f' is not lower triangular
+        if np.triu(matrix_f, 1).any():
+            tensor_r_p = np.linalg.qr(tensor_r_p, mode = 'r')
+            vector_signs = np.sign(
+                np.diagonal(tensor_r_p, axis1 = 1, axis2 = 2)
+            )
+            vector_signs[vector_signs == 0] = 1
+            tensor_r_p *= vector_signs[:, :, None]
+
+    # Add the weight offset matrix
+    for vector_sigma_row in matrix_sigma_rows:
+        cholesky_rank_one_update(
+            tensor_r = tensor_r_p,
+            matrix_x = np.tile(vector_sigma_row, (len(tensor_r_p), 1)),
+        )
+
+    # Create 'matrix_r_phi', the factors multiplied
+    # by the transition vectors, and from it
+    # 'vector_q', the variance multipliers
+    matrix_r_phi = np.einsum(
+        'nij,nj->ni',
+        tensor_r_p,
+        matrix_phi,
+    )
+    vector_q = float_delta + np.einsum(
+        'ni,ni->n',
+        matrix_r_phi,
+        matrix_r_phi,
+    )
+
+    # Create 'matrix_p_phi', each pre-posterior
+    # weight matrix multiplied by its transition
+    # vector
+    matrix_p_phi = np.einsum(
+        'nji,nj->ni',
+        tensor_r_p,
+        matrix_r_phi,
+    )
+
+    # Create 'vector_e', the residual estimates
+    vector_e = vector_x_t - np.einsum(
+        'ni,ni->n',
+        matrix_phi,
+        matrix_f_m,
+    )
+
+    # Create 'matrix_m_t', the posterior mean vectors
+    matrix_m_t = matrix_f_m + matrix_p_phi * (vector_e / vector_q)[:, None]
+
+    # Create 'tensor_r_t', the factors of the
+    # posterior weight matrices, by scaling the
+    # pre-posterior weight matrices by 1 / delta and
+    # removing the gain term g g.T q
+    tensor_r_t = tensor_r_p / np.sqrt(float_delta)
+    cholesky_rank_one_update(
+        tensor_r = tensor_r_t,
+        matrix_x = matrix_p_phi / np.sqrt(vector_q)[:, None],
+        float_sign = -1,
+    )
+
+    # Return the posterior means and factors
+    return (
+        matrix_m_t,
+        tensor_r_t
+    )
+
+
+
+
+# Define the 'arma_batch_memory' function
+
+# Prerequisites:
+# - None
+
+def arma_batch_memory(
+    int_series,
+    int_length,
+    int_state,
+    int_inputs = 1,
+    dtype_float = np.float64,
+    str_update = 'dense',
+):
+
+    '''
+    The 'arma_batch_memory' function estimates the
+    peak memory in bytes that 'filter_arma_batch'
+    needs to filter 'int_series' series of length
+    'int_length' (including any predictions) with a
+    state of size 'int_state', such as 151 for
+    three series with 50 autoregression terms each.
+
+    'int_inputs' is the number of series used for
+    autoregression for each main series, which is
+    3 if both extra series are given.
+
+    The weight matrices and the temporary arrays the
+    update makes from them dominate: about seven
+    state by state matrices per series for the dense
+    update and four for the factored one.
+    '''
+
+    # Create 'int_matrices', the number of state by
+    # state matrices held per series at once
+    int_matrices = 4 if str_update == 'cholesky' else 7
+
+    # Create 'int_values', the number of values
+    # held per series: the weight matrices, a few
+    # state vectors, the padded input series and
+    # the predictions
+    int_values = (
+        int_matrices * int_state ** 2
+        + 4 * int_state
+        + int_inputs * (int_length + int_state)
+        + 2 * int_length
+    )
+
+    # Return the estimate in bytes
+    return int_series * int_values * np.dtype(dtype_float).itemsize
+
+
+
+
+# Define the 'filter_arma_batch' function
+
+# Prerequisites:
+# - 'matrix_extender' // function
+# - 'arma_hyperpar_ext_batch' // function
+# - 'bayesian_update_batch' // function
+# - 'covariance_root_rows' // function
+# - 'bayesian_update_cholesky' // function
+# - 'arma_batch_memory' // function
+
+def filter_arma_batch(
+    matrix_x,
+    tuple_hyperpar,
+    vector_phi,
+    matrix_y = None,
+    matrix_z = None,
+    float_delta = 1,
+    int_ar_terms = 0,
+    int_series_cut = 0,
+    int_series_pred = 0,
+    str_update = 'dense',
+    dtype_float = np.float64,
+    int_max_bytes = None,
+):
+
+    '''
+    The 'filter_arma_batch' function fits the same
+    DLM as 'filter_arma' to many series at once, such
+    as every store and product family, and gives the
+    same predictions.
+
+    Each row of 'matrix_x' is a separate series, and
+    rows of 'matrix_y' and 'matrix_z' are the extra
+    series used to aid with its predictions. All
+    series are advanced together at each time step.
+
+    The prior mean and weight matrix in
+    'tuple_hyperpar' can either be shared by all
+    series or given per series, with an extra leading
+    axis.
+
+    If 'str_update' is 'cholesky', the weight
+    matrices are held as triangular factors and
+    updated with 'bayesian_update_cholesky', which
+    stays accurate over long histories and is much
+    faster for large 'int_ar_terms'. This needs the
+    prior weight matrices to be positive definite.
+
+    'dtype_float' sets the precision of the state
+    and predictions, so 'np.float32' halves their
+    memory, and is best used with the factored
+    update. If 'int_max_bytes' is given and the
+    estimate from 'arma_batch_memory' for all the
+    series is larger, the series are filtered in as
+    many groups as are needed to stay within it.
+
+    Returns a matrix with a row of predictions for
+    each series.
+    '''
+
+    # Create 'matrix_x', the main series as a
+    # float matrix
+    matrix_x = np.asarray(
+        matrix_x,
+        dtype = dtype_float,
+    )
+
+    # Create 'int_series', the number of series
+    # and 'int_x_length', the length of each
+    int_series, int_x_length = matrix_x.shape
+
+    # Create 'int_x_cut_length', the length of the
+    # series to actually be analysed
+    int_x_cut_length = int_x_length - int_series_cut
+
+    # Create 'int_x_pred_length', the length of the
+    # series once the predictions are added
+    int_x_pred_length = int_x_cut_length + int_series_pred
+
+    # Create 'int_terms', the number of terms in
+    # the DLM before any autoregression terms
+    int_terms = len(vector_phi)
+
+    # Create 'int_inputs', the number of series
+    # used for autoregression for each main series
+    int_inputs = sum(
+        matrix_main is not None and np.size(matrix_main) > 0
+        for matrix_main in (matrix_x, matrix_y, matrix_z)
+    )
+
+    # Create 'int_series_bytes', the estimated
+    # memory needed by each series
+    int_series_bytes = arma_batch_memory(
+        int_series = 1,
+        int_length = int_x_pred_length,
+        int_state = int_terms + int_inputs * int_ar_terms,
+        int_inputs = int_inputs,
+        dtype_float = dtype_float,
+        str_update = str_update,
+    )
+
+    # Filter the series in groups if they would
+    # not fit within 'int_max_bytes' together
+    if int_max_bytes is not None and int_series * int_series_bytes > int_max_bytes:
+
+        # Create 'int_group', the number of series
+        # in each group
+        int_group = max(int_max_bytes // int_series_bytes, 1)
+
+        # Create 'matrix_predictions', the matrix on
+        # which the predictions of every group are
+        # stored
+        matrix_predictions = np.zeros(
+            shape = (
+                int_series,
+                int_x_pred_length
+            ),
+            dtype = dtype_float,
+        )
+
+        # Filter each group of series in turn
+        for int_start in range(0, int_series, int_group):
+
+            # Create 'slice_group', the rows of
+            # the series in this group
+            slice_group = slice(int_start, int_start + int_group)
+
+            # Take the group's own prior if each
+            # series has one
+            tuple_hyperpar_group = (
+                tuple_hyperpar[0][slice_group] if np.ndim(tuple_hyperpar[0]) == 2 else tuple_hyperpar[0],
+                tuple_hyperpar[1][slice_group] if np.ndim(tuple_hyperpar[1]) == 3 else tuple_hyperpar[1],
+                tuple_hyperpar[2],
+                tuple_hyperpar[3],
+            )
+
+            matrix_predictions[slice_group] = filter_arma_batch(
+                matrix_x = matrix_x[slice_group],
+                tuple_hyperpar = tuple_hyperpar_group,
+                vector_phi = vector_phi,
+                matrix_y = None if matrix_y is None else np.asarray(matrix_y)[slice_group],
+                matrix_z = None if matrix_z is None else np.asarray(matrix_z)[slice_group],
+                float_delta = float_delta,
+                int_ar_terms = int_ar_terms,
+                int_series_cut = int_series_cut,
+                int_series_pred = int_series_pred,
+                str_update = str_update,
+                dtype_float = dtype_float,
+            )
+
+        return matrix_predictions
+
+    # Give every series its own copy of the prior
+    # mean and weight matrix
+    tuple_hyperpar = (
+        np.broadcast_to(
+            tuple_hyperpar[0],
+            (int_series, int_terms),
+        ).astype(dtype_float),
+        np.broadcast_to(
+            tuple_hyperpar[1],
+            (int_series, int_terms, int_terms),
+        ).astype(dtype_float),
+        np.asarray(tuple_hyperpar[2], dtype = dtype_float),
+        np.asarray(tuple_hyperpar[3], dtype = dtype_float),
+    )
+
+    # Create 'list_padded', the list of series used
+    # for autoregression, each with 'int_ar_terms'
+    # zeros in front so a window of past observations
+    # can be sliced for any time step
+    list_padded = list()
+
+    # Loop over the series that have any data, as
+    # 'filter_arma' does
+    for matrix_main in (matrix_x, matrix_y, matrix_z):
+
+        # Skip series that are not given
+        if matrix_main is None or np.size(matrix_main) == 0:
+            continue
+
+        # Extend the hyperparameters to incorporate
+        # autoregression terms reserved for 'matrix_main'
+        tuple_hyperpar = arma_hyperpar_ext_batch(
+            int_ar_terms = int_ar_terms,
+            tuple_hyperpar = tuple_hyperpar,
+        )
+
+        # Give 'matrix_main' the length of the series
+        # once the predictions are added
+        matrix_main = np.asarray(
+            matrix_main,
+            dtype = dtype_float,
+        )
+        matrix_main = matrix_extender(
+            matrix_main = matrix_main,
+            int_extension = int_x_pred_length - matrix_main.shape[1],
+        )
+
+        # Add the leading zeros and store the result
+        list_padded.append(
+            np.pad(
+                array = matrix_main,
+                pad_width = ((0, 0), (int_ar_terms, 0)),
+            )
+        )
+
+    # Unpack the final hyperparameters, in the
+    # precision asked for
+    matrix_m, tensor_b, matrix_f, matrix_sigma = (
+        array_hyperpar.astype(dtype_float, copy = False)
+        for array_hyperpar in tuple_hyperpar
+    )
+
+    # Replace the weight matrices with their upper
+    # triangular factors, and the weight offset
+    # matrix with its rows, for the factored update
+    if str_update == 'cholesky':
+        tensor_b = np.linalg.cholesky(tensor_b).transpose(0, 2, 1).copy()
+        matrix_sigma = covariance_root_rows(
+            matrix_sigma = matrix_sigma,
+        ).astype(dtype_float)
+    elif str_update != 'dense':
+        raise ValueError(f"unknown update mode '{str_update}'")
+
+    # Create 'matrix_phi_mod', the transition vectors
+    # of every series, which start with 'vector_phi'
+    # and are followed by past observations
+    matrix_phi_mod = np.zeros(
+        shape = (
+            int_series,
+            matrix_m.shape[1]
+        ),
+        dtype = dtype_float,
+    )
+    matrix_phi_mod[:, : int_terms] = vector_phi
+
+    # Create 'matrix_predictions', the matrix on
+    # which all model predictions are stored
+    matrix_predictions = np.zeros(
+        shape = (
+            int_series,
+            int_x_pred_length
+        ),
+        dtype = dtype_float,
+    )
+
+    # For 'int_t', loop from 0 to 'int_x_cut_length' - 1
+    for int_t in range(0, int_x_cut_length):
+
+        # Fill in the past observations of every
+        # series used for autoregression
+        for int_i, matrix_padded in enumerate(list_padded):
+            int_start = int_terms + int_i * int_ar_terms
+            matrix_phi_mod[:, int_start: int_start + int_ar_terms] = (
+                matrix_padded[:, int_t: int_t + int_ar_terms]
+            )
+
+        # Create 'matrix_f_m', the prior means
+        # multiplied by the transition matrix
+        matrix_f_m = matrix_m @ matrix_f.T
+
+        # Create the predictions for every series
+        # and store their discrete versions
+        matrix_predictions[:, int_t] = np.einsum(
+            'ni,ni->n',
+            matrix_phi_mod,
+            matrix_f_m,
+        )
+
+        # Update the model hyperparameters, with the
+        # factored update if it was asked for
+        if str_update == 'cholesky':
+            matrix_m, tensor_b = bayesian_update_cholesky(
+                vector_x_t = matrix_x[:, int_t],
+                matrix_m_t_minus = matrix_m,
+                tensor_r_t_minus = tensor_b,
+                matrix_phi = matrix_phi_mod,
+                matrix_f = matrix_f,
+                matrix_sigma_rows = matrix_sigma,
+                float_delta = float_delta,
+                matrix_f_m = matrix_f_m,
+            )
+        else:
+            matrix_m, tensor_b = bayesian_update_batch(
+                vector_x_t = matrix_x[:, int_t],
+                matrix_m_t_minus = matrix_m,
+                tensor_b_t_minus = tensor_b,
+                matrix_phi = matrix_phi_mod,
+                matrix_f = matrix_f,
+                matrix_sigma = matrix_sigma,
+                float_delta = float_delta,
+                matrix_f_m = matrix_f_m,
+            )
+
+    # Make the one-step predictions discrete
+    # and non negative
+    matrix_predictions = np.maximum(
+        np.round(matrix_predictions),
+        0
+    )
+
+    # Replace the main series after the cut with
+    # the predictions, so these are used for
+    # autoregression in future iterations
+    if list_padded:
+        list_padded[0][:, int_ar_terms + int_x_cut_length:] = 0
+
+    # Create 'matrix_f_m', the posterior means
+    # carried forward to each horizon one
+    # multiplication by the transition matrix at a
+    # time, rather than with a fresh power of it
+    matrix_f_m = matrix_m
+
+    # The loop for generating the model predictions
+    for int_t in range(int_x_cut_length, int_x_pred_length):
+
+        # Fill in the past observations of every
+        # series used for autoregression
+        for int_i, matrix_padded in enumerate(list_padded):
+            int_start = int_terms + int_i * int_ar_terms
+            matrix_phi_mod[:, int_start: int_start + int_ar_terms] = (
+                matrix_padded[:, int_t: int_t + int_ar_terms]
+            )
+
+        matrix_f_m = matrix_f_m @ matrix_f.T
+
+        # Create the discrete predictions
+        vector_prediction = np.maximum(
+            np.round(
+                np.einsum(
+                    'ni,ni->n',
+                    matrix_phi_mod,
+                    matrix_f_m,
+                )
+            ),
+            0
+        )
+
+        matrix_predictions[:, int_t] = vector_prediction
+
+        # Store the predictions for use in
+        # future iterations
+        if list_padded:
+            list_padded[0][:, int_ar_terms + int_t] = vector_prediction
+
+    return matrix_predictions
+
+
+
+
+# Define the 'OnlineArma' class
+
+# Prerequisites:
+# - 'arma_hyperpar_ext_batch' // function
+# - 'bayesian_update_batch' // function
+
+class OnlineArma:
+
+    '''
+    The 'OnlineArma' class holds the state of the
+    DLM used by 'filter_arma' for one or many series,
+    so it can be updated one time step at a time as
+    new observations arrive, rather than refitted to
+    the whole history.
+
+    Feeding a series to 'update' one observation at
+    a time gives the same one-step predictions as
+    'filter_arma', and 'forecast' then gives the same
+    predictions as its forecasting loop.
+
+    The state can be saved to and loaded from a
+    binary snapshot with 'save' and 'load'.
+    '''
+
+    # Create 'tuple_arrays', the names of the
+    # attributes stored in a snapshot
+    tuple_arrays = (
+        'vector_phi',
+        'matrix_m',
+        'tensor_b',
+        'matrix_f',
+        'matrix_sigma',
+        'vector_n',
+        'vector_s',
+        'tensor_lags',
+    )
+
+    def __init__(
+        self,
+        tuple_hyperpar,
+        vector_phi,
+        int_series = 1,
+        int_exog = 0,
+        float_delta = 1,
+        int_ar_terms = 0,
+        dtype_float = np.float64,
+    ):
+
+        '''
+        Create the state for 'int_series' series,
+        each with 'int_exog' extra series to aid
+        with its predictions, from the prior
+        hyperparameters in 'tuple_hyperpar'.
+
+        As for 'filter_arma_batch', the prior mean
+        and weight matrix can either be shared by all
+        series or given per series.
+
+        'dtype_float' sets the precision of the
+        state, which a snapshot keeps.
+        '''
+
+        # Create 'int_terms', the number of terms
+        # in the DLM before any autoregression terms
+        int_terms = len(vector_phi)
+
+        # Give every series its own copy of the
+        # prior mean and weight matrix
+        tuple_hyperpar = (
+            np.broadcast_to(
+                tuple_hyperpar[0],
+                (int_series, int_terms),
+            ).astype(dtype_float),
+            np.broadcast_to(
+                tuple_hyperpar[1],
+                (int_series, int_terms, int_terms),
+            ).astype(dtype_float),
+            np.asarray(tuple_hyperpar[2], dtype = dtype_float),
+            np.asarray(tuple_hyperpar[3], dtype = dtype_float),
+        )
+
+        # Extend the hyperparameters with the
+        # autoregression terms of the main series
+        # and each extra series
+        for int_i in range(1 + int_exog):
+            tuple_hyperpar = arma_hyperpar_ext_batch(
+                int_ar_terms = int_ar_terms,
+                tuple_hyperpar = tuple_hyperpar,
+            )
+
+        # Store the model settings
+        self.vector_phi = np.asarray(vector_phi, dtype = dtype_float)
+        self.float_delta = float_delta
+        self.int_ar_terms = int_ar_terms
+
+        # Store the hyperparameters, in the
+        # precision asked for
+        self.matrix_m, self.tensor_b, self.matrix_f, self.matrix_sigma = (
+            array_hyperpar.astype(dtype_float, copy = False)
+            for array_hyperpar in tuple_hyperpar
+        )
+
+        # Create the sample sizes and variances of
+        # the residuals of every series
+        self.vector_n = np.zeros(
+            shape = int_series,
+            dtype = int,
+        )
+        self.vector_s = np.zeros(
+            shape = int_series,
+            dtype = dtype_float,
+        )
+
+        # Create 'tensor_lags', the last
+        # 'int_ar_terms' observations of the main
+        # and extra series, oldest first, which
+        # start as zeros as in 'past_vector'
+        self.tensor_lags = np.zeros(
+            shape = (
+                int_series,
+                1 + int_exog,
+                int_ar_terms
+            ),
+            dtype = dtype_float,
+        )
+
+    def memory_usage(
+        self,
+    ):
+
+        '''
+        Return the memory held by the state in bytes.
+        '''
+
+        return sum(
+            getattr(self, str_name).nbytes
+            for str_name in self.tuple_arrays
+        )
+
+    def phi(
+        self,
+        tensor_lags,
+    ):
+
+        '''
+        Return the transition vectors of every
+        series, with the past observations in
+        'tensor_lags' after 'vector_phi'.
+        '''
+
+        return np.concatenate(
+            [
+                np.broadcast_to(
+                    self.vector_phi,
+                    (len(tensor_lags), len(self.vector_phi)),
+                ),
+                tensor_lags.reshape(len(tensor_lags), -1),
+            ],
+            axis = 1,
+        )
+
+    def exog_check(
+        self,
+        array_exog,
+        tuple_shape,
+        str_name,
+    ):
+
+        '''
+        Raise a 'ValueError' if the series have extra
+        series and 'array_exog', their values, is
+        missing or not of shape 'tuple_shape'.
+        '''
+
+        # Create 'int_exog', the number of extra
+        # series of each series
+        int_exog = self.tensor_lags.shape[1] - 1
+
+        # Check if there are no extra series to
+        # give values for
+        if int_exog == 0:
+            return
+
+        # Check if the values are missing
+        if array_exog is None:
+            raise ValueError(f"'{str_name}' must be given for a state with {int_exog} extra series")
+
+        # Check if the values have the wrong shape
+        if np.shape(array_exog) != tuple_shape:
+            raise ValueError(f"'{str_name}' must have shape {tuple_shape}, not {np.shape(array_exog)}")
+
+    def update(
+        self,
+        vector_x,
+        matrix_exog = None,
+    ):
+
+        '''
+        Update the state with the next observation
+        of every series, and of their extra series if
+        there are any, with one row per series in
+        'matrix_exog', which must then be given.
+
+        Returns the discrete predictions made for
+        these observations before they were seen.
+        '''
+
+        # Check the observations of the extra series
+        self.exog_check(
+            array_exog = matrix_exog,
+            tuple_shape = (len(self.tensor_lags), self.tensor_lags.shape[1] - 1),
+            str_name = 'matrix_exog',
+        )
+
+        # Create 'vector_x', the observations in
+        # the precision of the state
+        vector_x = np.asarray(
+            vector_x,
+            dtype = self.matrix_m.dtype,
+        )
+
+        # Create 'matrix_phi', the transition vectors
+        matrix_phi = self.phi(
+            tensor_lags = self.tensor_lags,
+        )
+
+        # Create 'matrix_f_m', the prior means
+        # multiplied by the transition matrix, and
+        # the predictions
+        matrix_f_m = self.matrix_m @ self.matrix_f.T
+        vector_predictions = np.einsum(
+            'ni,ni->n',
+            matrix_phi,
+            matrix_f_m,
+        )
+
+        # Update the state
+        self.matrix_m, self.tensor_b, self.vector_n, self.vector_s = bayesian_update_batch(
+            vector_x_t = vector_x,
+            matrix_m_t_minus = self.matrix_m,
+            tensor_b_t_minus = self.tensor_b,
+            matrix_phi = matrix_phi,
+            matrix_f = self.matrix_f,
+            matrix_sigma = self.matrix_sigma,
+            float_delta = self.float_delta,
+            matrix_f_m = matrix_f_m,
+            vector_s_t_minus = self.vector_s,
+            vector_n_t_minus = self.vector_n,
+        )
+
+        # Move the new observations on to the end
+        # of the lags, dropping the oldest
+        if self.int_ar_terms > 0:
+            self.tensor_lags[:, :, :-1] = self.tensor_lags[:, :, 1:]
+            self.tensor_lags[:, 0, -1] = vector_x
+            if matrix_exog is not None:
+                self.tensor_lags[:, 1:, -1] = matrix_exog
+
+        # Return the discrete predictions
+        return np.maximum(
+            np.round(vector_predictions),
+            0
+        )
+
+    def forecast(
+        self,
+        int_horizon,
+        tensor_exog = None,
+    ):
+
+        '''
+        Return the discrete predictions of every
+        series for the next 'int_horizon' time steps,
+        with one row per series, without changing the
+        state.
+
+        'tensor_exog' holds the values of the extra
+        series over the horizon, with shape
+        (series, extra series, 'int_horizon'), and
+        must be given if there are any.
+        '''
+
+        # Check the values of the extra series
+        self.exog_check(
+            array_exog = tensor_exog,
+            tuple_shape = (len(self.tensor_lags), self.tensor_lags.shape[1] - 1, int_horizon),
+            str_name = 'tensor_exog',
+        )
+
+        # Create 'tensor_lags', a copy of the lags
+        # with room for the whole horizon
+        tensor_lags = np.concatenate(
+            [
+                self.tensor_lags,
+                np.repeat(
+                    self.tensor_lags[:, :, -1:],
+                    int_horizon,
+                    axis = 2,
+                ) if self.int_ar_terms > 0 else np.zeros(
+                    shape = self.tensor_lags.shape[:2] + (int_horizon,),
+                    dtype = self.tensor_lags.dtype,
+                ),
+            ],
+            axis = 2,
+        )
+        if tensor_exog is not None:
+            tensor_lags[:, 1:, self.int_ar_terms:] = tensor_exog
+
+        # Create 'matrix_predictions', the array on
+        # which the predictions are stored
+        matrix_predictions = np.zeros(
+            shape = (
+                len(self.matrix_m),
+                int_horizon
+            ),
+            dtype = self.matrix_m.dtype,
+        )
+
+        # Carry the means forward one step at a time
+        matrix_f_m = self.matrix_m
+        for int_k in range(int_horizon):
+
+            matrix_f_m = matrix_f_m @ self.matrix_f.T
+
+            # Create the transition vectors from the
+            # window of lags ending before this step
+            matrix_phi = self.phi(
+                tensor_lags = tensor_lags[:, :, int_k: int_k + self.int_ar_terms],
+            )
+
+            # Create the discrete predictions
+            vector_predictions = np.maximum(
+                np.round(
+                    np.einsum(
+                        'ni,ni->n',
+                        matrix_phi,
+                        matrix_f_m,
+                    )
+                ),
+                0
+            )
+            matrix_predictions[:, int_k] = vector_predictions
+
+            # Use the predictions in place of the
+            # unknown observations of the main series
+            tensor_lags[:, 0, int_k + self.int_ar_terms] = vector_predictions
+
+        return matrix_predictions
+
+    def save(
+        self,
+        str_path,
+    ):
+
+        '''
+        Save the state as a binary snapshot at
+        'str_path', which should end in '.npz'.
+        '''
+
+        np.savez(
+            str_path,
+            float_delta = self.float_delta,
+            int_ar_terms = self.int_ar_terms,
+            **{str_name: getattr(self, str_name) for str_name in self.tuple_arrays},
+        )
+
+    @classmethod
+    def load(
+        cls,
+        str_path,
+    ):
+
+        '''
+        Load a state saved with 'save'.
+        '''
+
+        # Create the state without a prior, and
+        # fill it in from the snapshot
+        onlinearma_state = cls.__new__(cls)
+        with np.load(str_path) as npzfile_snapshot:
+            onlinearma_state.float_delta = float(npzfile_snapshot['float_delta'])
+            onlinearma_state.int_ar_terms = int(npzfile_snapshot['int_ar_terms'])
+            for str_name in cls.tuple_arrays:
+                setattr(onlinearma_state, str_name, npzfile_snapshot[str_name])
+
+        return onlinearma_state
+
+
+
+
+# Define the 'shared_series_attach' function
+
+# Prerequisites:
+# - None
+
+def shared_series_attach(
+    dict_blocks,
+    dict_settings,
+):
+
+    '''
+    The 'shared_series_attach' function is run
+    once in each worker of 'grid_search_arma' to
+    attach to the shared memory holding the
+    series, so they are not copied to every task.
+
+    'dict_blocks' maps the name of each matrix of
+    series to the name and shape of its shared
+    memory block, and 'dict_settings' holds the
+    rest of the data the tasks need, such as the
+    base hyperparameters.
+    '''
+
+    # Keep the settings for the worker's tasks
+    dict_shared_series.update(dict_settings)
+    dict_shared_series['list_sharedmemory'] = list()
+
+    # For each matrix of series
+    for str_key, (str_name, tuple_shape) in dict_blocks.items():
+
+        # Attach to the shared memory block
+        sharedmemory_series = multiprocessing.shared_memory.SharedMemory(
+            name = str_name,
+        )
+
+        # Keep the block, and the matrix of series
+        # viewing it, for the worker's tasks
+        dict_shared_series['list_sharedmemory'].append(sharedmemory_series)
+        dict_shared_series[str_key] = np.ndarray(
+            shape = tuple_shape,
+            dtype = float,
+            buffer = sharedmemory_series.buf,
+        )
+
+
+
+
+# Define the 'arma_candidate_score' function
+
+# Prerequisites:
+# - 'filter_arma_batch' // function
+
+def arma_candidate_score(
+    dict_candidate,
+    vector_rows,
+    int_series_cut,
+    dict_data = None,
+):
+
+    '''
+    The 'arma_candidate_score' function fits the
+    DLM given by one set of hyperparameters to the
+    series in the rows 'vector_rows' of the series
+    'matrix_x' in 'dict_data', holding out the last
+    'int_series_cut' points of each.
+
+    'dict_data' also holds the extra series
+    'matrix_y' and 'matrix_z' (or None), and the
+    base hyperparameters 'tuple_hyperpar' and
+    'vector_phi' of the DLM, as described in
+    'grid_search_arma'. If it is not given, the
+    data attached by 'shared_series_attach' is used.
+
+    Returns the sum of the squared log errors of
+    the held out predictions and how many there
+    were, so scores can be combined across calls.
+    '''
+
+    # Check that some points are held out
+    if int_series_cut < 1:
+        raise ValueError(f"'int_series_cut' must be at least 1, not {int_series_cut}")
+
+    # Use the shared data if none was given
+    if dict_data is None:
+        dict_data = dict_shared_series
+
+    # Create 'matrix_x_rows', the series to be
+    # scored, and the rows of their extra series
+    matrix_x_rows = dict_data['matrix_x'][vector_rows]
+    matrix_y_rows, matrix_z_rows = (
+        None if dict_data[str_key] is None else dict_data[str_key][vector_rows]
+        for str_key in ['matrix_y', 'matrix_z']
+    )
+
+    # Create 'tuple_hyperpar', the base
+    # hyperparameters for these series, taking the
+    # rows of any given per series
+    array_m, array_b, matrix_f, matrix_sigma = dict_data['tuple_hyperpar']
+    if np.ndim(array_m) == 2:
+        array_m = array_m[vector_rows]
+    if np.ndim(array_b) == 3:
+        array_b = array_b[vector_rows]
+
+    # Replace the prior weight matrix and weight
+    # offset with multiples of the identity if the
+    # candidate sets them
+    int_terms = len(dict_data['vector_phi'])
+    if 'float_prior_variance' in dict_candidate:
+        array_b = dict_candidate['float_prior_variance'] * np.eye(int_terms)
+    if 'float_sigma' in dict_candidate:
+        matrix_sigma = dict_candidate['float_sigma'] * np.eye(int_terms)
+
+    # Create the predictions
+    matrix_predictions = filter_arma_batch(
+        matrix_x = matrix_x_rows,
+        tuple_hyperpar = (
+            array_m,
+            array_b,
+            matrix_f,
+            matrix_sigma,
+        ),
+        vector_phi = dict_data['vector_phi'],
+        matrix_y = matrix_y_rows,
+        matrix_z = matrix_z_rows,
+        float_delta = dict_candidate['float_delta'],
+        int_ar_terms = dict_candidate['int_ar_terms'],
+        int_series_cut = int_series_cut,
+        int_series_pred = int_series_cut,
+    )
+
+    # Create 'matrix_log_errors', the log errors of
+    # the predictions for the held out points
+    matrix_log_errors = (
+        np.log1p(matrix_predictions[:, -int_series_cut:])
+        - np.log1p(np.maximum(matrix_x_rows[:, -int_series_cut:], 0))
+    )
+
+    # Return the sum of squares and the count
+    return (
+        float(np.sum(matrix_log_errors ** 2)),
+        matrix_log_errors.size
+    )
+
+
+
+
+# Define the 'grid_search_arma' function
+
+# Prerequisites:
+# - 'shared_series_attach' // function
+# - 'arma_candidate_score' // function
+
+def grid_search_arma(
+    matrix_x,
+    dict_grid,
+    tuple_hyperpar = None,
+    vector_phi = None,
+    matrix_y = None,
+    matrix_z = None,
+    int_series_cut = 16,
+    int_random_samples = None,
+    int_rounds = 4,
+    float_tolerance = 0.1,
+    int_jobs = None,
+    int_seed = 0,
+):
+
+    '''
+    The 'grid_search_arma' function searches for
+    the hyperparameters of the DLM used by
+    'filter_arma' that best predict the last
+    'int_series_cut' points of each series, scored
+    by their root mean squared log error (RMSLE).
+
+    Each row of 'matrix_x' is a series, such as the
+    sales of one store and product family, and the
+    rows of 'matrix_y' and 'matrix_z' are the extra
+    series used to aid with its predictions, as for
+    'filter_arma_batch'.
+
+    'tuple_hyperpar' and 'vector_phi' are the base
+    DLM, as for 'filter_arma_batch'. By default this
+    is a level model whose prior mean is the first
+    observation of each series, with a prior weight
+    of 0.5 and a weight offset of 0.9.
+
+    'dict_grid' maps each of 'int_ar_terms' and
+    'float_delta', and optionally
+    'float_prior_variance' and 'float_sigma', to a
+    list of values to try. The last two replace the
+    prior weight matrix and weight offset of the
+    base DLM with that multiple of the identity.
+    Every combination is tried, unless
+    'int_random_samples' is given, in which case
+    that many are picked at random.
+
+    The series are split into 'int_rounds' groups,
+    which are scored one after the other. After each
+    round, candidates whose RMSLE so far is more than
+    'float_tolerance' worse than the best are
+    dropped, so little time is spent on them.
+
+    The candidates are spread over a pool of
+    'int_jobs' processes, which read the series from
+    shared memory. If 'int_jobs' is 1, everything
+    runs in this process.
+
+    Returns a dataframe with one row per candidate,
+    best first.
+    '''
+
+    # Check that some points are held out
+    if int_series_cut < 1:
+        raise ValueError(f"'int_series_cut' must be at least 1, not {int_series_cut}")
+
+    # Create 'matrix_x', the series as a float
+    # matrix
+    matrix_x = np.ascontiguousarray(
+        matrix_x,
+        dtype = float,
+    )
+
+    # Create 'dict_data', the series and base
+    # hyperparameters every candidate is fitted
+    # with, using the level model if no base DLM
+    # was given
+    if tuple_hyperpar is None:
+        tuple_hyperpar = (
+            matrix_x[:, :1],
+            np.array([[0.5]]),
+            np.array([[1]]),
+            np.array([[0.9]]),
+        )
+        vector_phi = np.array([1])
+    dict_data = {
+        'matrix_x': matrix_x,
+        'matrix_y': None if matrix_y is None else np.ascontiguousarray(matrix_y, dtype = float),
+        'matrix_z': None if matrix_z is None else np.ascontiguousarray(matrix_z, dtype = float),
+        'tuple_hyperpar': tuple_hyperpar,
+        'vector_phi': np.asarray(vector_phi),
+    }
+
+    # Create 'dict_values', the values to try for
+    # each hyperparameter, with defaults for any
+    # not in 'dict_grid'
+    dict_values = {
+        'int_ar_terms': [0],
+        'float_delta': [1],
+    }
+    dict_values.update(dict_grid)
+
+    # Create 'list_candidates', the list of
+    # hyperparameter combinations to try
+    list_candidates = [
+        dict(zip(dict_values, tuple_values))
+        for tuple_values in itertools.product(*dict_values.values())
+    ]
+
+    # Create a random number generator for picking
+    # candidates and splitting the series
+    generator_random = np.random.default_rng(
+        seed = int_seed,
+    )
+
+    # Pick 'int_random_samples' candidates at random
+    # if a random search was asked for
+    if int_random_samples is not None and int_random_samples < len(list_candidates):
+        vector_picks = generator_random.choice(
+            a = len(list_candidates),
+            size = int_random_samples,
+            replace = False,
+        )
+        list_candidates = [list_candidates[int_i] for int_i in sorted(vector_picks)]
+
+    # Create 'list_rounds', the rows of the series
+    # scored in each round
+    list_rounds = np.array_split(
+        generator_random.permutation(len(matrix_x)),
+        np.minimum(int_rounds, len(matrix_x)),
+    )
+
+    # Create 'matrix_scores', holding the sum of
+    # squared log errors and their count for each
+    # candidate, and 'vector_rounds', the number of
+    # rounds each candidate has been scored in
+    matrix_scores = np.zeros(
+        shape = (
+            len(list_candidates),
+            2
+        ),
+    )
+    vector_rounds = np.zeros(
+        shape = len(list_candidates),
+        dtype = int,
+    )
+
+    # Create 'list_active', the indices of the
+    # candidates that are still being scored
+    list_active = list(range(len(list_candidates)))
+
+    # Create the process pool, with the series in
+    # shared memory, unless running in this process
+    list_sharedmemory = list()
+    executor_pool = None
+    if int_jobs != 1:
+
+        # Create 'dict_blocks', the name and shape
+        # of the shared memory block holding each
+        # matrix of series, and 'dict_settings',
+        # the rest of the data
+        dict_blocks = dict()
+        dict_settings = dict()
+        for str_key, array_data in dict_data.items():
+            if not str_key.startswith('matrix_') or array_data is None:
+                dict_settings[str_key] = array_data
+                continue
+            sharedmemory_series = multiprocessing.shared_memory.SharedMemory(
+                create = True,
+                size = max(array_data.nbytes, 1),
+            )
+            list_sharedmemory.append(sharedmemory_series)
+            np.ndarray(
+                shape = array_data.shape,
+                dtype = float,
+                buffer = sharedmemory_series.buf,
+            )[:] = array_data
+            dict_blocks[str_key] = (
+                sharedmemory_series.name,
+                array_data.shape
+            )
+
+        executor_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers = int_jobs,
+            initializer = shared_series_attach,
+            initargs = (
+                dict_blocks,
+                dict_settings
+            ),
+        )
+
+    try:
+
+        # Score the active candidates on each group
+        # of series in turn
+        for vector_rows in list_rounds:
+
+            # Score the candidates, in the pool if
+            # there is one
+            if executor_pool is None:
+                list_results = [
+                    arma_candidate_score(
+                        dict_candidate = list_candidates[int_i],
+                        vector_rows = vector_rows,
+                        int_series_cut = int_series_cut,
+                        dict_data = dict_data,
+                    )
+                    for int_i in list_active
+                ]
+            else:
+                list_results = list(
+                    executor_pool.map(
+                        arma_candidate_score,
+                        [list_candidates[int_i] for int_i in list_active],
+                        itertools.repeat(vector_rows),
+                        itertools.repeat(int_series_cut),
+                    )
+                )
+
+            # Add the results to the running scores
+            for int_i, tuple_result in zip(list_active, list_results):
+                matrix_scores[int_i] += tuple_result
+                vector_rounds[int_i] += 1
+
+            # Create 'vector_rmsle', the RMSLE so far
+            # of the active candidates
+            vector_rmsle = np.sqrt(
+                matrix_scores[list_active, 0] / matrix_scores[list_active, 1]
+            )
+
+            # Drop the candidates that are clearly
+            # losing to the best
+            list_active = [
+                int_i for int_i, float_rmsle in zip(list_active, vector_rmsle)
+                if float_rmsle <= np.nanmin(vector_rmsle) * (1 + float_tolerance)
+            ]
+
+    finally:
+
+        # Shut down the pool and free the shared
+        # memory
+        if executor_pool is not None:
+            executor_pool.shutdown()
+        for sharedmemory_series in list_sharedmemory:
+            sharedmemory_series.close()
+            sharedmemory_series.unlink()
+
+    # Create 'dataframe_results', one row for each
+    # candidate with its score
+    dataframe_results = pd.DataFrame(
+        data = list_candidates,
+    )
+    dataframe_results['float_rmsle'] = np.sqrt(
+        matrix_scores[:, 0] / matrix_scores[:, 1]
+    )
+    dataframe_results['int_series_scored'] = [
+        sum(len(list_rounds[int_r]) for int_r in range(int_n))
+        for int_n in vector_rounds
+    ]
+    dataframe_results['bool_stopped_early'] = vector_rounds < len(list_rounds)
+
+    # Sort the candidates, putting those scored on
+    # every series first and the best of them at
+    # the top
+    dataframe_results = dataframe_results.sort_values(
+        by = [
+            'bool_stopped_early',
+            'float_rmsle'
+        ],
+    )
+
+    # Return the results with a clean index
+    return index_reset(
+        dataframe = dataframe_results,
+    )
+
+
+
+
+def zero_one_scaler(
+    series_main
+):
+
+    minmaxscaler_scale = sklearn.preprocessing.MinMaxScaler(
+    feature_range = (0, 1)
+    )
+
+    matrix_main = series_main.values.reshape(-1,1)
+
+    matrix_scaled_main = minmaxscaler_scale.fit_transform(
+    X = matrix_main
+    )
+
+    series_scaled_main = pd.Series(
+        data = matrix_scaled_main.reshape(-1)
+    )
+    
+    return (
+        series_scaled_main,
+        minmaxscaler_scale
+    )
+
+def null_detection(
+    dataframe
+):
+
+    bool_output = dataframe.isnull().any().any()
+
+    return bool_output
+
+
+
+
+# Define the 'panel_array' function
+
+# Prerequisites:
+# - None
+
+def panel_array(
+    dataframe_train,
+    str_value = 'sales',
+    dtype_float = np.float64,
+    str_path = None,
+):
+
+    '''
+    The 'panel_array' function pivots the training
+    data set once into a dense array with one series
+    of 'str_value' for each store and product family,
+    with axes (store, family, date), so any series
+    can be taken from it without filtering the data
+    set again.
+
+    Every date from the first to the last is
+    included, and days without an observation, such
+    as Christmas, are NaN.
+
+    If 'str_path' is given, the array is written to
+    a '.npy' file there and returned memory-mapped,
+    so it can also be reopened later with
+    'np.load(str_path, mmap_mode = 'r')'.
+
+    Returns the array and the stores, families and
+    dates along its axes. The series for a store
+    and family is then
+    'tensor_panel[index_stores.get_loc(store),
+    index_families.get_loc(family)]'.
+    '''
+
+    # Create 'series_dates', the dates of the
+    # observations
+    series_dates = pd.to_datetime(
+        arg = dataframe_train['date'],
+    )
+
+    # Create the indices of the three axes
+    index_stores = pd.Index(
+        data = np.sort(dataframe_train['store_nbr'].unique()),
+    )
+    index_families = pd.Index(
+        data = np.sort(dataframe_train['family'].unique()),
+    )
+    index_dates = pd.date_range(
+        start = series_dates.min(),
+        end = series_dates.max(),
+    )
+
+    # Create 'tuple_shape', the shape of the panel
+    tuple_shape = (
+        len(index_stores),
+        len(index_families),
+        len(index_dates)
+    )
+
+    # Create 'tensor_panel', filled with NaN, in
+    # memory or in a file
+    if str_path is None:
+        tensor_panel = np.empty(
+            shape = tuple_shape,
+            dtype = dtype_float,
+        )
+    else:
+        tensor_panel = np.lib.format.open_memmap(
+            filename = str_path,
+            mode = 'w+',
+            dtype = dtype_float,
+            shape = tuple_shape,
+        )
+    tensor_panel[:] = np.nan
+
+    # Put every observation in its place, found
+    # for all observations at once
+    tensor_panel[
+        index_stores.get_indexer(dataframe_train['store_nbr']),
+        index_families.get_indexer(dataframe_train['family']),
+        index_dates.get_indexer(series_dates),
+    ] = dataframe_train[str_value].to_numpy()
+
+    # Write the array out if it is in a file
+    if str_path is not None:
+        tensor_panel.flush()
+
+    # Return the panel and its indices
+    return (
+        tensor_panel,
+        index_stores,
+        index_families,
+        index_dates
+    )
+
+
+
+
+# Define the 'panel_zero_one_scaler' function
+
+# Prerequisites:
+# - None
+
+def panel_zero_one_scaler(
+    tensor_panel,
+):
+
+    '''
+    The 'panel_zero_one_scaler' function is the
+    vectorised version of 'zero_one_scaler', scaling
+    every series along the last axis of
+    'tensor_panel' to the range 0 to 1 at once.
+
+    NaN entries are ignored, and constant series
+    are scaled to 0, as 'MinMaxScaler' does.
+
+    Returns the scaled panel and the minimum and
+    range of each series, for undoing the scaling.
+    '''
+
+    # Create 'tensor_min' and 'tensor_range', the
+    # minimum and range of each series
+    tensor_min = np.nanmin(
+        tensor_panel,
+        axis = -1,
+        keepdims = True,
+    )
+    tensor_range = np.nanmax(
+        tensor_panel,
+        axis = -1,
+        keepdims = True,
+    ) - tensor_min
+
+    # Use a range of 1 for constant series
+    tensor_range = np.where(
+        tensor_range == 0,
+        1,
+        tensor_range,
+    )
+
+    # Create the scaled panel
+    tensor_scaled = (tensor_panel - tensor_min) / tensor_range
+
+    # Return the scaled panel with the scaling
+    return (
+        tensor_scaled,
+        tensor_min,
+        tensor_range
+    )
+
+
+
+
+# Define the 'panel_null_detection' function
+
+# Prerequisites:
+# - None
+
+def panel_null_detection(
+    tensor_panel,
+):
+
+    '''
+    The 'panel_null_detection' function generalises
+    'null_detection' to a panel, checking every
+    series along the last axis of 'tensor_panel' at
+    once.
+
+    Returns a boolean array with one entry per
+    series, True where the series has any NaN.
+    '''
+
+    return np.isnan(tensor_panel).any(axis = -1)
+
+
+
+
+# Define the 'panel_correlation' function
+
+# Prerequisites:
+# - None
+
+def panel_correlation(
+    tensor_panel,
+    int_extension = 0,
+):
+
+    '''
+    The 'panel_correlation' function calculates,
+    for every store and product family of a panel
+    from 'panel_array', the Pearson correlation
+    between the store's series and the total of the
+    family's series over all stores.
+
+    This replaces looping over the stores with
+    'scipy.stats.pearsonr' for one family at a time.
+    'int_extension' is applied to every series first
+    as in 'matrix_extender', such as -16 to leave out
+    the test period.
+
+    NaN entries count as zero sales, and the
+    correlation of a constant series is NaN.
+
+    Returns a (store, family) array of correlations.
+    '''
+
+    # Create 'tensor_series', the series with NaN
+    # entries as zeros
+    tensor_series = np.nan_to_num(
+        matrix_extender(
+            matrix_main = tensor_panel,
+            int_extension = int_extension,
+        )
+    )
+
+    # Create 'matrix_total', each family's total
+    # over all stores
+    matrix_total = tensor_series.sum(
+        axis = 0,
+    )
+
+    # Centre the series and totals
+    tensor_centred = tensor_series - tensor_series.mean(axis = -1, keepdims = True)
+    matrix_total_centred = matrix_total - matrix_total.mean(axis = -1, keepdims = True)
+
+    # Create 'matrix_covariance', the covariance
+    # of each series with its family's total,
+    # up to a constant factor
+    matrix_covariance = np.einsum(
+        'sfd,fd->sf',
+        tensor_centred,
+        matrix_total_centred,
+    )
+
+    # Create the correlations, with NaN where a
+    # series or total is constant
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        matrix_correlation = matrix_covariance / (
+            np.sqrt((tensor_centred ** 2).sum(axis = -1))
+            * np.sqrt((matrix_total_centred ** 2).sum(axis = -1))
+        )
+
+    return matrix_correlation
+
+
+
+
+# Define the 'csv_signature' function
+
+# Prerequisites:
+# - None
+
+def csv_signature(
+    str_csv_path,
+    str_check = 'mtime',
+):
+
+    '''
+    The 'csv_signature' function describes the
+    current version of a CSV file, for telling
+    whether a cache made from it is out of date.
+
+    If 'str_check' is 'mtime', this is the file's
+    size and modification time, which is instant.
+    If it is 'hash', it is the SHA-256 hash of the
+    file, which also notices a file replaced by one
+    with the same modification time.
+    '''
+
+    # Create 'stat_csv', the size and times of
+    # the file
+    stat_csv = os.stat(str_csv_path)
+
+    # Check if the file is to be hashed
+    if str_check == 'hash':
+
+        # Hash the file a block at a time
+        hash_csv = hashlib.sha256()
+        with open(str_csv_path, 'rb') as file_csv:
+            for bytes_block in iter(lambda: file_csv.read(1 << 20), b''):
+                hash_csv.update(bytes_block)
+
+        return {
+            'size': stat_csv.st_size,
+            'sha256': hash_csv.hexdigest()
+        }
+
+    # Check if 'str_check' is not recognised
+    if str_check != 'mtime':
+        raise ValueError(f"'str_check' must be 'mtime' or 'hash', not {str_check!r}")
+
+    return {
+        'size': stat_csv.st_size,
+        'mtime_ns': stat_csv.st_mtime_ns
+    }
+
+
+
+
+# Define the 'csv_cache_write' function
+
+# Prerequisites:
+# - None
+
+def csv_cache_write(
+    str_csv_path,
+    str_cache_dir,
+    dict_signature,
+):
+
+    '''
+    The 'csv_cache_write' function parses a CSV
+    file of the competition data once and stores it
+    in 'str_cache_dir' as one '.npy' file per
+    column, with the types in 'dict_column_dtypes'.
+
+    Columns not listed there are stored as
+    categories if they hold text, as 'float32' if
+    they hold decimals and otherwise as the smallest
+    integer type that fits. Category columns are
+    stored as their integer codes, with the
+    categories themselves kept in 'columns.json'
+    alongside 'dict_signature'.
+
+    Every file is written under a temporary name
+    and then moved into place, so a data frame
+    returned earlier by 'read_csv_cached' keeps
+    mapping the old columns when the cache is
+    rebuilt.
+    '''
+
+    # Create 'list_names', the names of the columns
+    # in the file
+    list_names = pd.read_csv(
+        filepath_or_buffer = str_csv_path,
+        nrows = 0,
+    ).columns.tolist()
+
+    # Create 'dataframe_csv', the parsed file,
+    # reading the known columns as their types
+    dataframe_csv = pd.read_csv(
+        filepath_or_buffer = str_csv_path,
+        dtype = {
+            str_column: dict_column_dtypes[str_column]
+            for str_column in list_names
+            if dict_column_dtypes.get(str_column, 'datetime64[ns]') != 'datetime64[ns]'
+        },
+        parse_dates = [
+            str_column
+            for str_column in list_names
+            if dict_column_dtypes.get(str_column) == 'datetime64[ns]'
+        ],
+    )
+
+    # Create the cache directory
+    os.makedirs(
+        name = str_cache_dir,
+        exist_ok = True,
+    )
+
+    # Create 'list_columns', the description of
+    # each stored column
+    list_columns = []
+
+    # For each column of 'dataframe_csv'
+    for int_column, str_column in enumerate(dataframe_csv.columns):
+
+        # Create 'series_column', the column, in
+        # its type for the cache
+        series_column = dataframe_csv[str_column]
+        if str_column not in dict_column_dtypes:
+            if series_column.dtype == object:
+                series_column = series_column.astype('category')
+            elif series_column.dtype.kind == 'f':
+                series_column = series_column.astype('float32')
+            elif series_column.dtype.kind in 'iu':
+                series_column = pd.to_numeric(
+                    arg = series_column,
+                    downcast = 'integer',
+                )
+
+        # Create 'dict_column', the description of
+        # the column, and 'vector_column', the
+        # values stored for it
+        dict_column = {
+            'name': str_column,
+            'file': f'{int_column}.npy',
+        }
+        if isinstance(series_column.dtype, pd.CategoricalDtype):
+            dict_column['categories'] = series_column.cat.categories.tolist()
+            vector_column = series_column.cat.codes.to_numpy()
+        else:
+            vector_column = series_column.to_numpy()
+        list_columns.append(dict_column)
+
+        # Save the column to a new file which then
+        # replaces the old one, so data frames still
+        # mapping the old file keep their data
+        str_column_path = os.path.join(str_cache_dir, dict_column['file'])
+        str_temp_path = f'{str_column_path}.{os.getpid()}.tmp'
+        with open(str_temp_path, 'wb') as file_column:
+            np.save(
+                file = file_column,
+                arr = vector_column,
+            )
+        os.replace(str_temp_path, str_column_path)
+
+    # Save the description of the columns last,
+    # so it marks a complete cache
+    str_temp_path = os.path.join(str_cache_dir, f'columns.json.{os.getpid()}.tmp')
+    with open(str_temp_path, 'w', encoding = 'utf8') as file_json:
+        json.dump(
+            obj = {
+                'signature': dict_signature,
+                'columns': list_columns,
+            },
+            fp = file_json,
+        )
+    os.replace(str_temp_path, os.path.join(str_cache_dir, 'columns.json'))
+
+
+
+
+# Define the 'read_csv_cached' function
+
+# Prerequisites:
+# - 'csv_signature' // function
+# - 'csv_cache_write' // function
+
+def read_csv_cached(
+    str_csv_path,
+    str_cache_dir = None,
+    str_check = 'mtime',
+):
+
+    '''
+    The 'read_csv_cached' function reads one of
+    the competition CSV files as a data frame with
+    compact types, such as categorical families,
+    'int16' store numbers, 'float32' sales and
+    'datetime64' dates.
+
+    The file is only parsed the first time, or
+    when it has changed according to 'str_check'
+    (see 'csv_signature'). Otherwise the columns
+    are loaded from the cache in 'str_cache_dir',
+    by default a '.cache' directory next to the
+    file, by memory mapping them rather than
+    parsing any text.
+
+    Each column, including the codes of the
+    categories, stays a copy-on-write map of its
+    file in the data frame, so only the pages that are used are
+    read into memory, and changing the data frame
+    never changes the cache.
+    '''
+
+    # Create 'str_cache_dir', the directory for
+    # this file's cache, if not given
+    if str_cache_dir is None:
+        str_dir, str_file = os.path.split(os.path.abspath(str_csv_path))
+        str_cache_dir = os.path.join(
+            str_dir,
+            '.cache',
+            os.path.splitext(str_file)[0],
+        )
+
+    # Create 'dict_signature', the current version
+    # of the file
+    dict_signature = csv_signature(
+        str_csv_path = str_csv_path,
+        str_check = str_check,
+    )
+
+    # Read the description of the cached columns,
+    # if there is one
+    str_json_path = os.path.join(str_cache_dir, 'columns.json')
+    dict_cache = None
+    if os.path.exists(str_json_path):
+        with open(str_json_path, 'r', encoding = 'utf8') as file_json:
+            dict_cache = json.load(file_json)
+
+    # Check if the cache is missing or out of date,
+    # and remake it if so
+    if dict_cache is None or dict_cache['signature'] != dict_signature:
+        csv_cache_write(
+            str_csv_path = str_csv_path,
+            str_cache_dir = str_cache_dir,
+            dict_signature = dict_signature,
+        )
+        with open(str_json_path, 'r', encoding = 'utf8') as file_json:
+            dict_cache = json.load(file_json)
+
+    # Create 'dict_columns', each column mapped
+    # from the cache
+    dict_columns = dict()
+    for dict_column in dict_cache['columns']:
+        vector_column = np.load(
+            file = os.path.join(str_cache_dir, dict_column['file']),
+            mmap_mode = 'c',
+        )
+        if 'categories' in dict_column:
+            dict_columns[dict_column['name']] = pd.Categorical.from_codes(
+                codes = vector_column,
+                categories = dict_column['categories'],
+            )
+        else:
+            dict_columns[dict_column['name']] = vector_column
+
+    # Return the columns as a data frame, with one
+    # block per column so they are not copied into
+    # combined blocks
+    return pd.DataFrame(
+        data = dict_columns,
+        copy = False,
+    )
+
+
+
+
+# Define the 'load_competition_data' function
+
+# Prerequisites:
+# - 'read_csv_cached' // function
+
+def load_competition_data(
+    str_data_dir,
+    str_check = 'mtime',
+):
+
+    '''
+    The 'load_competition_data' function reads the
+    training, test, oil price, transactions and
+    stores data sets from 'str_data_dir' with
+    'read_csv_cached'.
+
+    Returns a dictionary of the data frames, with
+    the keys 'train', 'test', 'oil', 'transactions'
+    and 'stores'.
+    '''
+
+    return {
+        str_name: read_csv_cached(
+            str_csv_path = os.path.join(str_data_dir, f'{str_name}.csv'),
+            str_check = str_check,
+        )
+        for str_name in ['train', 'test', 'oil', 'transactions', 'stores']
+    }
@@ -1,3 +1,13 @@
+import hashlib
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from tqdm import tqdm
 
 class DownloadProgressBar(tqdm):
@@ -8,5 +18,470 @@ class DownloadProgressBar(tqdm):
         self.update(b * bsize - self.n)
 
 
+DOWNLOAD_CHUNK_SIZE = 1 << 22
+
+
+def _open_range(url, start=0, end=None, timeout=60):
+    """Request bytes `start` up to `end` (or the end) of `url`."""
+    request = urllib.request.Request(url)
+    if start or end is not None:
+        last = '' if end is None else end - 1
+        request.add_header('Range', f'bytes={start}-{last}')
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def _remote_size(url):
+    """Return the size of the file at `url`, or `None` if it is not known,
+    and whether the server can send parts of it."""
+    with _open_range(url, 0, 1) as response:
+        if response.status == 206:
+            size = response.headers.get('Content-Range', '').rpartition('/')[2]
+            return (int(size) if size.isdigit() else None), True
+        size = response.headers.get('Content-Length')
+        return (int(size) if size else None), False
+
+
+def _copy_response(response, file, chunk_size, on_chunk):
+    """Write a response to `file` a chunk at a time, without copying it."""
+    buffer = memoryview(bytearray(chunk_size))
+    while True:
+        size = response.readinto(buffer)
+        if not size:
+            return
+        file.write(buffer[:size])
+        on_chunk(buffer[:size])
+
+
+def _hash_file(digest, path, start, end, chunk_size):
+    """Add bytes `start` up to `end` of the file at `path` to `digest`."""
+    with open(path, 'rb', buffering=0) as file:
+        file.seek(start)
+        while start < end:
+            chunk = file.read(min(chunk_size, end - start))
+            if not chunk:
+                raise ValueError(f"{path} is shorter than expected")
+            digest.update(chunk)
+            start += len(chunk)
+
+
+def _download_stream(url, part_path, digest, bar, chunk_size):
+    """Download `url` in one request, resuming from the end of `part_path`
+    if the server allows it."""
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    try:
+        response = _open_range(url, done)
+    except urllib.error.HTTPError as error:
+        # asking for bytes past the end means the file is already complete
+        if error.code != 416 or not done:
+            raise
+        _hash_file(digest, part_path, 0, done, chunk_size)
+        bar.update(done)
+        return
+    with response:
+        if done and response.status != 206:
+            done = 0
+        length = response.headers.get('Content-Length')
+        if length:
+            bar.total = done + int(length)
+            bar.refresh()
+        if done:
+            _hash_file(digest, part_path, 0, done, chunk_size)
+            bar.update(done)
+
+        def on_chunk(chunk):
+            digest.update(chunk)
+            bar.update(len(chunk))
+
+        with open(part_path, 'ab' if done else 'wb', buffering=0) as file:
+            _copy_response(response, file, chunk_size, on_chunk)
+    if length and os.path.getsize(part_path) != done + int(length):
+        raise ValueError(f"{url} ended early")
+
+
+def _download_segments(url, part_path, size, segments, digest, bar,
+                       chunk_size):
+    """Download `url` as `segments` parts at once, into their places in
+    `part_path`.
+
+    The progress of each part is saved alongside so an interrupted download
+    can resume, and the file is hashed in order as its start arrives, while
+    the data is still in the page cache.
+    """
+    state_path = f'{part_path}.json'
+    state = None
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        with open(state_path, encoding='utf8') as file:
+            state = json.load(file)
+        if (state['url'], state['size'], len(state['parts'])) != (
+                url, size, segments):
+            state = None
+    if state is None:
+        bounds = [size * index // segments for index in range(segments + 1)]
+        state = {'url': url, 'size': size,
+                 'parts': [[start, end, start]
+                           for start, end in zip(bounds, bounds[1:])]}
+        with open(part_path, 'wb') as file:
+            file.truncate(size)
+
+    parts = state['parts']
+    changed = threading.Condition()
+    stopped = threading.Event()
+
+    def fetch(part):
+        start, end, done = part
+        if done >= end:
+            return
+        with _open_range(url, done, end) as response:
+            if response.status != 206:
+                raise ValueError(f"{url} was sent whole for a part request")
+            with open(part_path, 'r+b', buffering=0) as file:
+                file.seek(done)
+
+                def on_chunk(chunk):
+                    if stopped.is_set():
+                        raise InterruptedError(f"download of {url} stopped")
+                    with changed:
+                        part[2] += len(chunk)
+                        changed.notify()
+
+                _copy_response(response, file, chunk_size, on_chunk)
+        if part[2] != end:
+            raise ValueError(f"{url} ended early")
+
+    def contiguous():
+        return next((part[2] for part in parts if part[2] < part[1]), size)
+
+    def save():
+        with open(f'{state_path}.tmp', 'w', encoding='utf8') as file:
+            json.dump(state, file)
+        os.replace(f'{state_path}.tmp', state_path)
+
+    hashed = 0
+    shown = sum(part[2] - part[0] for part in parts)
+    bar.update(shown)
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [executor.submit(fetch, part) for part in parts]
+        try:
+            while True:
+                with changed:
+                    running = not all(future.done() for future in futures)
+                    if running:
+                        changed.wait(1)
+                    reached = contiguous()
+                    received = sum(part[2] - part[0] for part in parts)
+                    save()
+                bar.update(received - shown)
+                shown = received
+                _hash_file(digest, part_path, hashed, reached, chunk_size)
+                hashed = reached
+                if not running:
+                    break
+        finally:
+            stopped.set()
+            with changed:
+                save()
+        for future in futures:
+            future.result()
+    os.remove(state_path)
+
+
+def download(url, path, sha256=None, segments=1, chunk_size=DOWNLOAD_CHUNK_SIZE,
+             desc=None):
+    """Download `url` to `path` with a `DownloadProgressBar`, unless `path`
+    already exists.
+
+    Data goes to `<path>.part` until it is complete, and an interrupted
+    download resumes from where it stopped if the server accepts range
+    requests. With `segments` above 1, that many parts are fetched at once,
+    and a download interrupted this way resumes part by part whatever
+    `segments` is next time.
+    The data is hashed as it arrives and, if `sha256` is given, checked
+    against it before the file is moved into place; a file that does not
+    match is deleted.
+
+    Returns the SHA-256 hex digest, or `None` if `path` already existed.
+    """
+    if os.path.exists(path):
+        return None
+    part_path = f'{path}.part'
+    state_path = f'{part_path}.json'
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        # the part file of a segmented download is as long as the whole file,
+        # so it can only be resumed in the same parts
+        with open(state_path, encoding='utf8') as file:
+            segments = len(json.load(file)['parts'])
+    digest = hashlib.sha256()
+    with DownloadProgressBar(unit='B', unit_scale=True, unit_divisor=1024,
+                             miniters=1, desc=desc or os.path.basename(path)
+                             ) as bar:
+        size, ranges = (None, False) if segments <= 1 else _remote_size(url)
+        if size and ranges:
+            bar.total = size
+            _download_segments(url, part_path, size, min(segments, size),
+                               digest, bar, chunk_size)
+        else:
+            # the parts of an earlier download cannot be resumed in one stream
+            if os.path.exists(state_path):
+                for stale_path in (part_path, state_path):
+                    if os.path.exists(stale_path):
+                        os.remove(stale_path)
+            _download_stream(url, part_path, digest, bar, chunk_size)
+
+    if sha256 is not None and digest.hexdigest() != sha256.lower():
+        os.remove(part_path)
+        raise ValueError(f"{url} has SHA-256 {digest.hexdigest()}, not "
+                         f"{sha256}")
+    os.replace(part_path, path)
+    return digest.hexdigest()
+
+
 def pprint(results, dp=3):
-    print('\r\n'.join(f"{w} ({s:.0{dp}f})" for w, s in results))
\ No newline at end of file
+    print('\r\n'.join(f"{w} ({s:.0{dp}f})" for w, s in results))
+
+
+def normalise_rows(vectors):
+    """Return a float32 copy of `vectors` with each row scaled to unit length
+    (rows of zeros are left as they are)."""
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    return vectors
+
+
+class NeighbourIndex:
+    """Nearest neighbours of word vectors by cosine similarity.
+
+    Takes a gensim `KeyedVectors` model, an `EmbeddingStore`, or an array of
+    vectors and their words. The vectors are unit-normalised once, so that
+    queries are matrix products, and `most_similar` gives the same results
+    as gensim's, which can be passed straight to `pprint`.
+
+    The normalised vectors of a model or array are a float32 copy held in
+    memory, while those of a store are mapped from a normalised store on
+    disk (see `EmbeddingStore.unit_vectors`), so are not copied.
+    """
+
+    def __init__(self, vectors, words=None, cache_size=1024, batch_size=256):
+        if words is None:
+            words = getattr(vectors, 'index_to_key', None)
+            if words is None:
+                words = vectors.index2word
+            if hasattr(vectors, 'unit_vectors'):
+                vectors = vectors.unit_vectors()
+            else:
+                vectors = normalise_rows(vectors.vectors)
+        else:
+            vectors = normalise_rows(vectors)
+        self.words = list(words)
+        self.index = {w: i for i, w in enumerate(self.words)}
+        self.vectors = vectors
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.words)
+
+    def _key(self, positive, negative, topn):
+        if isinstance(positive, str):
+            positive = [positive]
+        if isinstance(negative, str):
+            negative = [negative]
+        return tuple(positive), tuple(negative), topn
+
+    def _query(self, positive, negative):
+        # mean of the unit vectors, as gensim weights them
+        rows = [self.index[w] for w in positive + negative]
+        weights = np.array([1] * len(positive) + [-1] * len(negative),
+                           dtype=np.float32)
+        query = weights @ self.vectors[rows] / len(rows)
+        return query / (np.linalg.norm(query) or 1), rows
+
+    def _remember(self, key, results):
+        self.cache[key] = results
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def most_similar(self, positive=(), negative=(), topn=10):
+        return self.most_similar_batch([(positive, negative)], topn)[0]
+
+    def most_similar_batch(self, queries, topn=10):
+        """Answer many `(positive, negative)` queries at once, returning a
+        list of `(word, similarity)` lists."""
+        keys = [self._key(positive, negative, topn)
+                for positive, negative in queries]
+        results = {}
+        new = []
+        for key in keys:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                results[key] = self.cache[key]
+            elif key not in results:
+                results[key] = None
+                new.append(key)
+
+        for start in range(0, len(new), self.batch_size):
+            batch = new[start:start + self.batch_size]
+            queries, excluded = zip(*(self._query(positive, negative)
+                                      for positive, negative, _ in batch))
+            scores = np.stack(queries) @ self.vectors.T
+            for row, rows in enumerate(excluded):
+                scores[row, rows] = -np.inf
+
+            # only the best `topn` need sorting
+            k = min(topn, len(self.words))
+            if k < len(self.words):
+                best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                best = np.broadcast_to(np.arange(k), (len(batch), k))
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+            for key, words, similarities in zip(batch, best, best_scores):
+                results[key] = [(self.words[w], float(s))
+                                for w, s in zip(words, similarities)
+                                if s != -np.inf]
+                self._remember(key, results[key])
+        return [results[key] for key in keys]
+
+    def similarity(self, pairs):
+        """Return the cosine similarity of each `(word, word)` pair."""
+        first, second = zip(*pairs)
+        first = self.vectors[[self.index[w] for w in first]]
+        second = self.vectors[[self.index[w] for w in second]]
+        return np.einsum('ij,ij->i', first, second).tolist()
+
+
+def _embedding_rows(file, binary, dim):
+    """Yield the word and vector of each row of an opened embedding file."""
+    if not binary:
+        for line in file:
+            parts = line.rstrip().split(b' ')
+            if len(parts) > 1:
+                yield (b' '.join(parts[:-dim]),
+                       np.array(parts[-dim:], dtype=np.float32))
+        return
+
+    row_bytes = 4 * dim
+    buffer = b''
+    position = 0
+    while True:
+        space = buffer.find(b' ', position)
+        while space == -1 or len(buffer) < space + 1 + row_bytes:
+            chunk = file.read(1 << 20)
+            if not chunk:
+                if buffer[position:].strip():
+                    raise ValueError("embedding file ends within a row")
+                return
+            buffer = buffer[position:] + chunk
+            position = 0
+            space = buffer.find(b' ')
+        yield (buffer[position:space].lstrip(b'\n'),
+               np.frombuffer(buffer, '<f4', dim, space + 1))
+        position = space + 1 + row_bytes
+
+
+def convert_embeddings(source_path, store_path, binary=None):
+    """Convert a word2vec (text or binary) or GloVe embedding file into a
+    store of a float32 `.npy` matrix and a `.vocab` file of its words.
+
+    `binary` defaults to whether `source_path` ends in `.bin`.
+    """
+    if binary is None:
+        binary = source_path.endswith('.bin')
+    with open(source_path, 'rb') as file:
+        header = file.readline().split()
+        if len(header) == 2:
+            count, dim = map(int, header)
+        else:
+            # GloVe text files have no header, so count the rows first
+            dim = len(header) - 1
+            count = 1 + sum(1 for line in file if line.strip())
+            file.seek(0)
+
+        vocab_path = f'{store_path}.vocab.{os.getpid()}.tmp'
+        matrix_path = f'{store_path}.npy.{os.getpid()}.tmp'
+        matrix = np.lib.format.open_memmap(
+            matrix_path, mode='w+', dtype=np.float32, shape=(count, dim))
+        rows = 0
+        with open(vocab_path, 'w', encoding='utf8', newline='\n') as vocab:
+            for rows, (word, vector) in enumerate(
+                    _embedding_rows(file, binary, dim), 1):
+                if rows > count:
+                    raise ValueError(f"{source_path} has more than the "
+                                     f"{count} rows in its header")
+                matrix[rows - 1] = vector
+                vocab.write(word.decode('utf8', 'replace') + '\n')
+        if rows != count:
+            raise ValueError(f"{source_path} has {rows} rows, not {count}")
+        matrix.flush()
+        del matrix
+
+    # the matrix is moved into place last, so marks a complete store
+    os.replace(vocab_path, f'{store_path}.vocab')
+    os.replace(matrix_path, f'{store_path}.npy')
+
+
+class EmbeddingStore:
+    """Word vectors memory-mapped from a store made by `convert_embeddings`.
+
+    Opening a store only reads its vocabulary; rows are paged in from disk
+    as they are used and shared through the page cache by every process
+    using the same store. It has the `vectors` and `index_to_key`
+    attributes of a gensim `KeyedVectors` model, so can be passed to
+    `NeighbourIndex`.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.vectors = np.load(f'{store_path}.npy', mmap_mode='r')
+        with open(f'{store_path}.vocab', encoding='utf8', newline='\n') as file:
+            self.index_to_key = file.read().split('\n')[:-1]
+        self.key_to_index = {w: i for i, w in enumerate(self.index_to_key)}
+
+    def __len__(self):
+        return len(self.index_to_key)
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    def __getitem__(self, word):
+        return self.vectors[self.key_to_index[word]]
+
+    def unit_vectors(self, rows_per_chunk=1 << 16):
+        """Return the vectors scaled to unit length, memory-mapped from
+        `<store>.unit.npy`, which is written a chunk of rows at a time the
+        first time it is needed or after the store changes."""
+        matrix_path = f'{self.store_path}.npy'
+        unit_path = f'{self.store_path}.unit.npy'
+        if (not os.path.exists(unit_path)
+                or os.path.getmtime(unit_path) < os.path.getmtime(matrix_path)):
+            temp_path = f'{unit_path}.{os.getpid()}.tmp'
+            unit = np.lib.format.open_memmap(
+                temp_path, mode='w+', dtype=np.float32,
+                shape=self.vectors.shape)
+            for start in range(0, len(self.vectors), rows_per_chunk):
+                end = start + rows_per_chunk
+                unit[start:end] = normalise_rows(self.vectors[start:end])
+            unit.flush()
+            del unit
+            os.replace(temp_path, unit_path)
+        return np.load(unit_path, mmap_mode='r')
+
+
+def load_embeddings(source_path, store_path=None, binary=None):
+    """Open the store for an embedding file, converting it first if the
+    store is missing or older than the file.
+
+    The store defaults to `source_path` without its extension.
+    """
+    if store_path is None:
+        store_path = os.path.splitext(source_path)[0]
+    matrix_path = f'{store_path}.npy'
+    if (not os.path.exists(matrix_path)
+            or os.path.getmtime(matrix_path) < os.path.getmtime(source_path)):
+        convert_embeddings(source_path, store_path, binary)
+    return EmbeddingStore(store_path)
@@ -0,0 +1,134 @@
+"""Tests of the downloader in `helpers.py` against a local HTTP server."""
+
+import hashlib
+import http.server
+import json
+import os
+import random
+import threading
+
+import pytest
+
+import helpers
+
+DATA = random.Random(0).randbytes(100_000)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serve `DATA` at every path, honouring single range requests."""
+
+    accept_ranges = True
+
+    def do_GET(self):
+        start, end = 0, len(DATA)
+        header = self.headers.get('Range')
+        if header and self.accept_ranges:
+            first, _, last = header.removeprefix('bytes=').partition('-')
+            start = int(first)
+            end = min(int(last) + 1 if last else len(DATA), len(DATA))
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(DATA)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{end - 1}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        self.wfile.write(DATA[start:end])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/vectors.bin'
+    server.shutdown()
+    server.server_close()
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('segments', [1, 4])
+def test_download(url, tmp_path, segments):
+    path = tmp_path / 'vectors.bin'
+    assert helpers.download(url, path, sha256=SHA256, segments=segments,
+                            chunk_size=4096) == SHA256
+    assert read(path) == DATA
+    assert os.listdir(tmp_path) == ['vectors.bin']
+    assert helpers.download(url, path) is None
+
+
+def test_resume_stream(url, tmp_path):
+    path = tmp_path / 'vectors.bin'
+    (tmp_path / 'vectors.bin.part').write_bytes(DATA[:30_000])
+    assert helpers.download(url, path, sha256=SHA256) == SHA256
+    assert read(path) == DATA
+
+
+def test_complete_part_file(url, tmp_path):
+    path = tmp_path / 'vectors.bin'
+    (tmp_path / 'vectors.bin.part').write_bytes(DATA)
+    assert helpers.download(url, path, sha256=SHA256) == SHA256
+    assert read(path) == DATA
+
+
+def test_server_without_ranges(url, tmp_path, monkeypatch):
+    monkeypatch.setattr(RangeHandler, 'accept_ranges', False)
+    path = tmp_path / 'vectors.bin'
+    (tmp_path / 'vectors.bin.part').write_bytes(b'\0' * 30_000)
+    assert helpers.download(url, path, sha256=SHA256, segments=4) == SHA256
+    assert read(path) == DATA
+
+
+def interrupted_segments(tmp_path):
+    """Leave the part file and state of a two part download stopped part
+    way through each part, with zeros where the data has not arrived."""
+    middle = len(DATA) // 2
+    parts = [[0, middle, 10_000], [middle, len(DATA), middle + 5_000]]
+    data = bytearray(len(DATA))
+    for start, _, done in parts:
+        data[start:done] = DATA[start:done]
+    (tmp_path / 'vectors.bin.part').write_bytes(data)
+    (tmp_path / 'vectors.bin.part.json').write_text(json.dumps(
+        {'url': None, 'size': len(DATA), 'parts': parts}))
+
+
+@pytest.mark.parametrize('segments', [1, 2, 4])
+def test_resume_segments(url, tmp_path, segments):
+    interrupted_segments(tmp_path)
+    state_path = tmp_path / 'vectors.bin.part.json'
+    state = json.loads(state_path.read_text())
+    state_path.write_text(json.dumps(dict(state, url=url)))
+    path = tmp_path / 'vectors.bin'
+    assert helpers.download(url, path, sha256=SHA256,
+                            segments=segments) == SHA256
+    assert read(path) == DATA
+    assert os.listdir(tmp_path) == ['vectors.bin']
+
+
+def test_resume_segments_without_ranges(url, tmp_path, monkeypatch):
+    interrupted_segments(tmp_path)
+    monkeypatch.setattr(RangeHandler, 'accept_ranges', False)
+    path = tmp_path / 'vectors.bin'
+    assert helpers.download(url, path, sha256=SHA256) == SHA256
+    assert read(path) == DATA
+    assert os.listdir(tmp_path) == ['vectors.bin']
+
+
+def test_wrong_checksum(url, tmp_path):
+    path = tmp_path / 'vectors.bin'
+    with pytest.raises(ValueError):
+        helpers.download(url, path, sha256='0' * 64)
+    assert os.listdir(tmp_path) == []